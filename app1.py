@@ -1,41 +1,87 @@
 import configparser
+import json
 import logging
 import os
 import threading
 import time
+import uuid
 import random
-import serial
 import pynmea2
 import math
-from flask import Flask, jsonify, render_template
+from flask import Flask, Response, g, jsonify, render_template, request
+from async_engine import AsyncAcquisition
+from broadcaster import Broadcaster
+import geodesy
+from fusion import HeadingFusion
+from history import FIELDS as HISTORY_FIELDS, SolutionHistory
+from logging_setup import configure_logging
+from metrics import INTERVAL_BUCKETS, LONG_POLL_BUCKETS, Registry
+from nmea_parser import GgaFix
+from heading_solver import REJECT_REASONS, REJECT_RESIDUAL, HeadingSolver
+from position_codec import CachedPosition, PositionCache
+from receivers import SerialMultiplexer, load_baselines, load_receivers
+from record_replay import Recorder, ReplaySource
+from shared_state import SharedStateReader, SharedStateWriter
+from snapshot import BaselineSolution, SnapshotStore
+import nmea_parser
+
+# --- 設定ファイル読み込み ---
+# 環境変数 GPS_COMPASS_CONFIG で別の設定ファイルを指定できる（ベンチマーク・検証用）
+config = configparser.ConfigParser()
+config.read(os.environ.get('GPS_COMPASS_CONFIG', 'config.ini'))
+
+# 配置形態: standalone（1プロセスで取得とWeb） / acquisition（取得のみ） / web（共有メモリを読むWebワーカー）
+DEPLOY_ROLE = os.environ.get('GPS_COMPASS_ROLE') or config.get('Deploy', 'Role', fallback='standalone')
 
 # --- ログ設定 ---
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler('app.log'),
-        logging.StreamHandler()
-    ]
+# 書き込みは専用スレッドで行い、センサー処理のスレッドではファイルI/Oを行わない
+# ローテーションするファイルは standalone / acquisition の1プロセスだけが持つ（Webワーカーは WebFile か標準エラー出力）
+log_queue_handler = configure_logging(
+    config.get('Logging', 'WebFile', fallback='') if DEPLOY_ROLE == 'web' else config.get('Logging', 'File', fallback='app.log'),
+    rotate=DEPLOY_ROLE != 'web',
+    max_bytes=config.getint('Logging', 'MaxBytes', fallback=5 * 1024 * 1024),
+    backup_count=config.getint('Logging', 'BackupCount', fallback=5),
+    rate_limit_interval=config.getfloat('Logging', 'RateLimitInterval', fallback=10.0),
+    rate_limit_burst=config.getint('Logging', 'RateLimitBurst', fallback=5)
 )
 logger = logging.getLogger(__name__)
 
-# --- 設定ファイル読み込み ---
-config = configparser.ConfigParser()
-config.read('config.ini')
-
 # --- 定数設定 ---
-GPS_BASE_PORT = config.get('GPS', 'BasePort', fallback='/dev/ttyUSB0')
-GPS_ROVER_PORT = config.get('GPS', 'RoverPort', fallback='/dev/ttyUSB1')
 BAUDRATE = config.getint('GPS', 'Baudrate', fallback=4800)
 BASELINE_LENGTH_METER = config.getfloat('GPS', 'BaselineLengthMeter', fallback=0.7)
 IMU_READ_INTERVAL = config.getfloat('IMU', 'ReadInterval', fallback=0.05)
-GPS_READ_INTERVAL = config.getfloat('GPS', 'ReadInterval', fallback=0.01)
+IMU_GYRO_NOISE = config.getfloat('IMU', 'GyroNoise', fallback=0.1)
+IMU_GYRO_BIAS_DRIFT = config.getfloat('IMU', 'GyroBiasDrift', fallback=0.01)
+GPS_HEADING_STD = config.getfloat('IMU', 'GpsHeadingStd', fallback=2.0)
+GPS_SENTENCES = frozenset(
+    t.strip().encode('ascii') for t in config.get('GPS', 'Sentences', fallback='GPGGA,GNGGA').split(',') if t.strip()
+)
 SERIAL_RETRY_INTERVAL = config.getfloat('GPS', 'SerialRetryInterval', fallback=5)
-EARTH_RADIUS_M = 6371000  # 地球の平均半径（メートル）
+SERIAL_RETRY_MAX_INTERVAL = config.getfloat('GPS', 'SerialRetryMaxInterval', fallback=60)
+# 受信機（[Receivers]）と基線（[Baselines]）。最初の基線を主基線としてIMU融合と /api/position の heading に使う
+RECEIVERS = load_receivers(config, BAUDRATE, GPS_SENTENCES)
+BASELINES = load_baselines(config, RECEIVERS, BASELINE_LENGTH_METER)
+PRIMARY_BASELINE = BASELINES[0]
 MAX_BASELINE_ERROR = config.getfloat('GPS', 'MaxBaselineError', fallback=0.1)
 HDOP_THRESHOLD = config.getfloat('GPS', 'HdopThreshold', fallback=2.0)
+SMOOTHING_WINDOW = config.getint('Smoothing', 'WindowSize', fallback=10)
+SMOOTHING_REJECT_ERROR = config.getfloat('Smoothing', 'RejectBaselineError', fallback=0.2)
+SMOOTHING_RESIDUAL_SCALE = config.getfloat('Smoothing', 'ResidualScale', fallback=0.05)
 DUMMY_MODE = config.getboolean('General', 'DummyMode', fallback=False)
+RECORD_FILE = config.get('Record', 'File', fallback='')
+REPLAY_FILE = config.get('Replay', 'File', fallback='')
+REPLAY_SPEED = config.getfloat('Replay', 'Speed', fallback=1.0)
+REPLAY_LOOP = config.getboolean('Replay', 'Loop', fallback=False)
+SHARED_STATE_PATH = config.get('Deploy', 'SharedStatePath', fallback='/dev/shm/gps_compass')
+SHARED_STATE_POLL_INTERVAL = config.getfloat('Deploy', 'PollInterval', fallback=0.02)
+HISTORY_CAPACITY = config.getint('History', 'Capacity', fallback=72000)
+HISTORY_MAX_BUCKETS = 5000
+# 取得エンジン: threads（デバイスごとのスレッド） / asyncio（1つのイベントループ、実機読み取り時のみ）
+ACQUISITION_ENGINE = config.get('Deploy', 'Engine', fallback='threads')
+ASYNC_STREAM_PORT = config.getint('Deploy', 'StreamPort', fallback=0)
+POSITION_LONG_POLL_TIMEOUT = 25.0  # /api/position?since= の既定の待ち時間（秒）
+POSITION_LONG_POLL_MAX_TIMEOUT = 60.0
+STATS_PUBLISH_INTERVAL = 1.0  # 取得プロセスが統計を共有メモリへ書き出す間隔（秒）
 
 # IMUライブラリのインポート
 IMU_AVAILABLE = False
@@ -47,32 +93,183 @@ except ImportError:
 
 app = Flask(__name__)
 
-# --- データを保持するクラス ---
-class SensorData:
-    def __init__(self):
-        self.base_data = {'lat': 0.0, 'lon': 0.0, 'hdop': 99.9}
-        self.rover_data = {'lat': 0.0, 'lon': 0.0, 'hdop': 99.9}
-        self.heading_gps = 0.0
-        self.heading_fused = 0.0  # 融合ヘディング
-        self.error = 0.0  # 基線誤差（メートル）
-        self.distance = 0.0  # ベースとローバー間の距離（メートル）
-        self.imu_status = False
-        self.imu_raw_gyro_z = 0.0
-        self.lock = threading.Lock()
-        self.last_fused_heading = 0.0  # 融合ヘディングの前回値
-
-sensor_data = SensorData()
+# --- センサー状態（不変スナップショットを参照の差し替えで公開） ---
+# --- メトリクス ---
+# pipeline_metrics: 取得・計算側（acquisition / standalone で更新）
+# web_metrics: Webリクエスト側（各ワーカーで更新）
+pipeline_metrics = Registry()
+web_metrics = Registry()
+metric_parse_failures = {
+    name: pipeline_metrics.counter('gps_parse_failures_total', "チェックサム後のデコード失敗数", receiver=name) for name in RECEIVERS
+}
+metric_fixes = {name: pipeline_metrics.counter('gps_fixes_total', "受信したGGA測位数", receiver=name) for name in RECEIVERS}
+for receiver in RECEIVERS.values():
+    for attr, name, help_text in (
+        ('bytes_read', 'gps_bytes_total', "シリアルから読み取ったバイト数"),
+        ('sentences', 'gps_sentences_total', "切り出したNMEA文の数"),
+        ('checksum_failures', 'gps_checksum_failures_total', "チェックサム不一致の文の数"),
+        ('overruns', 'gps_overruns_total', "欠落・長すぎる文の破棄数"),
+    ):
+        pipeline_metrics.callback(
+            name, help_text, lambda framer=receiver.framer, attr=attr: getattr(framer, attr), kind='counter', receiver=receiver.name
+        )
+for baseline in BASELINES:
+    for attr, name, help_text in (
+        ('matched', 'epoch_pairs_total', "UTC時刻で対になったエポック数"),
+        ('unmatched', 'epoch_unmatched_total', "相手が揃わず破棄されたエポック数"),
+        ('dropped', 'epoch_dropped_total', "計算が追いつかず破棄されたペア数"),
+    ):
+        pipeline_metrics.callback(
+            name, help_text, lambda matcher=baseline.matcher, attr=attr: getattr(matcher, attr), kind='counter', baseline=baseline.name
+        )
+metric_epoch_skew = {
+    b.name: pipeline_metrics.histogram('epoch_skew_seconds', "同一エポックの基準局・移動局の到着時刻差", baseline=b.name) for b in BASELINES
+}
+metric_gga_to_heading = {
+    b.name: pipeline_metrics.histogram('gga_to_heading_seconds', "エポックが揃ってからヘディングを公開するまでの時間", baseline=b.name)
+    for b in BASELINES
+}
+metric_compute = {
+    b.name: pipeline_metrics.histogram('heading_compute_seconds', "1エポックのヘディング計算時間", baseline=b.name) for b in BASELINES
+}
+metric_rejected = {
+    (b.name, reason): pipeline_metrics.counter('epochs_rejected_total', "計算から除外したエポック数", baseline=b.name, reason=reason)
+    for b in BASELINES for reason in REJECT_REASONS
+}
+metric_baseline_exceeded = {
+    b.name: pipeline_metrics.counter('baseline_error_exceeded_total', "基線長誤差が許容値を超えたエポック数", baseline=b.name)
+    for b in BASELINES
+}
+metric_snapshot_wait = pipeline_metrics.histogram('snapshot_update_wait_seconds', "スナップショット更新時の書き込みロック待ち時間")
+metric_imu_samples = pipeline_metrics.counter('imu_samples_total', "IMUサンプル数")
+metric_imu_errors = pipeline_metrics.counter('imu_errors_total', "IMU読み取りエラー数")
+metric_imu_interval = pipeline_metrics.histogram('imu_sample_interval_seconds', "IMUサンプル間隔（ジッターの確認用）", INTERVAL_BUCKETS)
+# リクエストスレッドごとに同時に更新されるためロック付き。ロングポーリング（since 指定）は待ち時間を含むので別のメトリクスにする
+metric_api = {
+    endpoint: web_metrics.histogram('api_request_seconds', "APIリクエストの処理時間", threadsafe=True, endpoint=path)
+    for endpoint, path in (('api_position', '/api/position'), ('api_stats', '/api/stats'), ('api_history', '/api/history'))
+}
+metric_api_long_poll = web_metrics.histogram(
+    'api_long_poll_seconds', "ロングポーリング（/api/position?since=）の応答までの時間", LONG_POLL_BUCKETS, threadsafe=True,
+    endpoint='/api/position'
+)
+web_metrics.callback(
+    'stream_clients', "/api/stream の接続数",
+    lambda: stream_broadcaster.clients + (acquisition_engine.stream_clients if acquisition_engine is not None else 0)
+)
+web_metrics.callback('log_records_dropped_total', "キュー満杯で破棄したログ数", lambda: log_queue_handler.dropped, kind='counter')
+
+sensor_data = SnapshotStore(metric_snapshot_wait)
+stream_broadcaster = Broadcaster()
+position_cache = PositionCache()
+# ETag の接頭辞。standalone は再起動でバージョンが巻き戻るため起動ごとの値、web は共有メモリのバージョン（巻き戻らない）を使う
+POSITION_ETAG_PREFIX = 's' if DEPLOY_ROLE == 'web' else uuid.uuid4().hex[:8] + '-'
+heading_solvers = {
+    b.name: HeadingSolver(b.length, HDOP_THRESHOLD, SMOOTHING_WINDOW, SMOOTHING_REJECT_ERROR, SMOOTHING_RESIDUAL_SCALE)
+    for b in BASELINES
+}
+heading_fusion = HeadingFusion(IMU_GYRO_NOISE, IMU_GYRO_BIAS_DRIFT)
+
+# --- プロセス間共有 ---
+# acquisition: 最新解と統計を共有メモリへ書き込む / web: それを読み取って配信する
+shared_position_writer = shared_stats_writer = shared_metrics_writer = None
+shared_position_reader = shared_stats_reader = shared_metrics_reader = None
+if DEPLOY_ROLE == 'acquisition':
+    shared_position_writer = SharedStateWriter(SHARED_STATE_PATH)
+    shared_stats_writer = SharedStateWriter(SHARED_STATE_PATH + '.stats')
+    shared_metrics_writer = SharedStateWriter(SHARED_STATE_PATH + '.metrics', capacity=65536)
+elif DEPLOY_ROLE == 'web':
+    shared_position_reader = SharedStateReader(SHARED_STATE_PATH)
+    shared_stats_reader = SharedStateReader(SHARED_STATE_PATH + '.stats')
+    shared_metrics_reader = SharedStateReader(SHARED_STATE_PATH + '.metrics')
+
+# 解のバージョン: 新しい解を公開するたびに1増える（測位・IMU状態だけの更新では増えない）。
+# /api/position の version・ETag・X-Position-Version・since はどの役割でもこの値を使う。
+# acquisition は再起動しても巻き戻らないよう共有メモリの値から続ける
+solution_lock = threading.Lock()
+solution_version = shared_position_writer.version if shared_position_writer is not None else 0
+
+# --- 解の履歴 ---
+# web ワーカーは acquisition プロセスが書き込む履歴ファイルを /api/history の初回要求時に開く
+solution_history = None
+if DEPLOY_ROLE == 'acquisition':
+    solution_history = SolutionHistory(HISTORY_CAPACITY, SHARED_STATE_PATH + '.history')
+elif DEPLOY_ROLE != 'web':
+    solution_history = SolutionHistory(HISTORY_CAPACITY)
+
+# --- 記録・再生 ---
+# Replay File を指定すると実機・ダミーの代わりに記録ファイルを同じ読み取り処理へ流し込む
+recorder = Recorder(RECORD_FILE) if RECORD_FILE and not REPLAY_FILE and DEPLOY_ROLE != 'web' else None
+replay_source = None
+if REPLAY_FILE and DEPLOY_ROLE != 'web':
+    replay_source = ReplaySource(REPLAY_FILE, REPLAY_SPEED, REPLAY_LOOP)
+    DUMMY_MODE = False
+    logger.info(f"記録ファイル {REPLAY_FILE} を再生します（速度: {f'{REPLAY_SPEED}倍' if REPLAY_SPEED > 0 else '最速'}）。")
+# 最速再生（Speed = 0）では計算スレッドを使わず、再生スレッドで揃ったエポックを順に計算する（全エポックを漏れなく処理）
+REPLAY_INLINE = replay_source is not None and REPLAY_SPEED <= 0
+
+# --- 取得エンジン ---
+acquisition_engine = None  # asyncio エンジン使用時の AsyncAcquisition
+if ACQUISITION_ENGINE == 'asyncio' and (DUMMY_MODE or replay_source is not None):
+    logger.info("ダミーデータ・記録ファイルの再生時は threads エンジンで動作します。")
+    ACQUISITION_ENGINE = 'threads'
+
+def decode_sentence(sentence):
+    # GGA/RMC/HDTは高速デコーダー、それ以外はpynmea2で解析する
+    if nmea_parser.is_supported(sentence):
+        return nmea_parser.parse(sentence)
+    return pynmea2.parse(sentence.decode('ascii'))
+
+def store_fix(receiver, fix: GgaFix):
+    metric_fixes[receiver.name].inc()
+    sensor_data.update_item('fixes', receiver.name, fix)
+    if fix.utc is not None:
+        for baseline in receiver.baselines:
+            baseline.matcher.submit(receiver.name, fix.utc, fix)
+
+def receive_data(receiver, data):
+    # 受信機から届いたバイト列を文に切り出し、GGAを測位データとして格納する
+    if recorder is not None:
+        recorder.write(receiver.name, data)
+    for sentence in receiver.framer.feed(data):
+        try:
+            msg = decode_sentence(sentence)
+        except (pynmea2.ParseError, ValueError, UnicodeDecodeError):
+            metric_parse_failures[receiver.name].inc()
+            continue
+        if isinstance(msg, GgaFix):
+            store_fix(receiver, msg)
+
+def replay_data(name, data):
+    receiver = RECEIVERS.get(name)
+    if receiver is not None:
+        receive_data(receiver, data)
+        if REPLAY_INLINE:
+            # 最速再生: 揃ったエポックを再生スレッドでその場で計算する（計算スレッドの待ち行列があふれて捨てられないように）
+            for baseline in receiver.baselines:
+                while True:
+                    pair = baseline.matcher.wait_pair(timeout=0)
+                    if pair is None:
+                        break
+                    try:
+                        process_pair(baseline, pair)
+                    except Exception as e:
+                        logger.error(f"基線 {baseline.name} の計算で予期せぬエラー: {e}")
 
 # --- IMU初期化 ---
 imu_device = None
-if IMU_AVAILABLE and not DUMMY_MODE:
+if replay_source is not None:
+    # 記録ファイルにIMUのチャンネルがあるときだけ再生用IMUを使う
+    IMU_AVAILABLE = replay_source.has_imu()
+    if IMU_AVAILABLE:
+        imu_device = replay_source.imu()
+elif IMU_AVAILABLE and not DUMMY_MODE and DEPLOY_ROLE != 'web':
     def initialize_imu():
         global imu_device, IMU_AVAILABLE
         while True:
             try:
                 imu_device = mpu6050(0x68)
-                with sensor_data.lock:
-                    sensor_data.imu_status = True
+                sensor_data.update(imu_status=True)
                 logger.info("IMUが正常に初期化されました。")
                 IMU_AVAILABLE = True
                 break
@@ -84,160 +281,419 @@ if IMU_AVAILABLE and not DUMMY_MODE:
     initialize_imu()
 
 # --- IMU読み取りスレッド ---
+last_imu_time = None  # 直前のIMUサンプル時刻（間隔の計測用）
+
 def read_imu_thread():
     while True:
         if DUMMY_MODE:
-            with sensor_data.lock:
-                sensor_data.imu_raw_gyro_z = random.uniform(-10.0, 10.0)
-                sensor_data.imu_status = True
+            update_imu(random.uniform(-10.0, 10.0), time.monotonic())
             time.sleep(IMU_READ_INTERVAL)
         else:
             if not IMU_AVAILABLE:
                 time.sleep(SERIAL_RETRY_INTERVAL)
                 continue
-            try:
-                gyro = imu_device.get_gyro_data()
-                with sensor_data.lock:
-                    sensor_data.imu_raw_gyro_z = gyro['z']
-                    sensor_data.imu_status = True
-            except Exception as e:
-                with sensor_data.lock:
-                    sensor_data.imu_status = False
-                logger.error(f"IMU読み取りエラー: {e}")
+            if not sample_imu():
                 time.sleep(SERIAL_RETRY_INTERVAL)
-            time.sleep(IMU_READ_INTERVAL)
+            if replay_source is None:
+                time.sleep(IMU_READ_INTERVAL)  # 再生時は記録されたサンプル間隔で get_gyro_data が待機する
 
-# --- GPS読み取りスレッド ---
-def read_gps_thread(port: str, target_key: str):
-    if DUMMY_MODE:
-        while True:
-            with sensor_data.lock:
-                if target_key == 'base':
-                    sensor_data.base_data['lat'] = random.uniform(35.680, 35.682)
-                    sensor_data.base_data['lon'] = random.uniform(139.765, 139.768)
-                    sensor_data.base_data['hdop'] = random.uniform(0.8, 1.5)
-                else:
-                    sensor_data.rover_data['lat'] = sensor_data.base_data['lat'] + random.uniform(-0.0001, 0.0001)
-                    sensor_data.rover_data['lon'] = sensor_data.base_data['lon'] + random.uniform(-0.0001, 0.0001)
-                    sensor_data.rover_data['hdop'] = random.uniform(0.8, 1.5)
-            time.sleep(random.uniform(0.5, 1.5))
+def sample_imu():
+    # IMUを1回読み取って融合ヘディングを更新する。失敗時は False
+    try:
+        gyro = imu_device.get_gyro_data()
+        if gyro is None:
+            # 再生用IMUにサンプルが届いていない: 最後の値を使い続けず、IMUは未使用として扱う
+            if sensor_data.current.imu_status:
+                sensor_data.update(imu_status=False)
+            return True
+        t = gyro.get('t') or time.monotonic()
+        if recorder is not None:
+            recorder.write_imu(gyro)
+        update_imu(gyro['z'], t)
+        return True
+    except Exception as e:
+        metric_imu_errors.inc()
+        sensor_data.update(imu_status=False)
+        logger.error(f"IMU読み取りエラー: {e}")
+        return False
+
+def update_imu(gyro_z, t):
+    # IMUサンプルごとにヘディングを積分し、融合ヘディングをIMUレートで配信する
+    global last_imu_time
+    metric_imu_samples.inc()
+    if last_imu_time is not None:
+        metric_imu_interval.observe(t - last_imu_time)
+    last_imu_time = t
+    fused_heading = heading_fusion.predict(gyro_z, t)
+    if heading_fusion.initialized:
+        publish_solution(sensor_data.update(
+            imu_raw_gyro_z=gyro_z, imu_status=True, heading_fused=fused_heading, heading_sigma=heading_fusion.heading_std()
+        ))
     else:
-        while True:
-            if not os.path.exists(port):
-                logger.error(f"GPSポート {port} が見つかりません。{SERIAL_RETRY_INTERVAL}秒後に再試行します。")
-                time.sleep(SERIAL_RETRY_INTERVAL)
-                continue
-            try:
-                ser = serial.Serial(port, BAUDRATE, timeout=0.5)
-                logger.info(f"GPSポート {port} が正常に開かれました。")
-            except serial.SerialException as e:
-                logger.error(f"GPSポート {port} を開けません: {e}。{SERIAL_RETRY_INTERVAL}秒後に再試行します。")
-                time.sleep(SERIAL_RETRY_INTERVAL)
-                continue
+        sensor_data.update(imu_raw_gyro_z=gyro_z, imu_status=True)
+
+# --- GPS読み取り ---
+def read_gps_thread():
+    # 全受信機のシリアルポートを1つのスレッドで多重化して読み取る
+    SerialMultiplexer(RECEIVERS.values(), receive_data, SERIAL_RETRY_INTERVAL).run()
+
+def dummy_gps_thread():
+    # 1Hzの受信機群を模擬: 最初の受信機から基線長の距離に他の受信機を置き（方位はゆっくり回転、数cmのノイズ付き）、
+    # 毎秒のエポックに少しの到着ずれを加えて出力
+    receivers = list(RECEIVERS.values())
+    while True:
+        now = time.time()
+        time.sleep(math.ceil(now) - now)
+        utc = time.time() % 86400
+        utc -= utc % 1.0
+        lat = random.uniform(35.680, 35.682)
+        lon = random.uniform(139.765, 139.768)
+        for i, receiver in enumerate(receivers):
+            time.sleep(random.uniform(0.0, 0.01))
+            fix_lat, fix_lon = lat, lon
+            if i > 0:
+                bearing = math.radians(utc * 3.0 + (i - 1) * 90.0 + random.gauss(0.0, 2.0))
+                length = BASELINE_LENGTH_METER + random.gauss(0.0, 0.02)
+                fix_lat += math.degrees(length * math.cos(bearing) / geodesy.EARTH_RADIUS_M)
+                fix_lon += math.degrees(length * math.sin(bearing) / (geodesy.EARTH_RADIUS_M * math.cos(math.radians(lat))))
+            store_fix(receiver, GgaFix(utc, fix_lat, fix_lon, 1, random.randint(6, 12), random.uniform(0.8, 1.5), 40.0))
+
+# --- ヘディングと誤差の計算スレッド ---
+def calculate_heading_and_error_thread(baseline):
+    # 基線ごとに1スレッド。同一UTCエポックの両端の受信機データが揃った時点で計算する（固定間隔のポーリングは行わない）
+    # 1エポックの計算で例外が出ても、この基線の計算を止めない
+    while True:
+        pair = baseline.matcher.wait_pair(timeout=1.0)
+        if pair is not None:
             try:
-                while True:
-                    line = ser.readline().decode('ascii', errors='ignore').strip()
-                    if line.startswith("$GPGGA"):
-                        try:
-                            msg = pynmea2.parse(line)
-                            with sensor_data.lock:
-                                if target_key == 'base':
-                                    sensor_data.base_data['lat'] = msg.latitude
-                                    sensor_data.base_data['lon'] = msg.longitude
-                                    sensor_data.base_data['hdop'] = float(msg.horizontal_dil)
-                                else:
-                                    sensor_data.rover_data['lat'] = msg.latitude
-                                    sensor_data.rover_data['lon'] = msg.longitude
-                                    sensor_data.rover_data['hdop'] = float(msg.horizontal_dil)
-                        except pynmea2.ParseError:
-                            continue
-                    time.sleep(GPS_READ_INTERVAL)
-            except serial.SerialException as e:
-                logger.error(f"GPSポート {port} でシリアル通信エラー: {e}。再接続を試みます。")
-                ser.close()
-                time.sleep(SERIAL_RETRY_INTERVAL)
+                process_pair(baseline, pair)
             except Exception as e:
-                logger.error(f"GPSポート {port} で予期せぬエラー: {e}。再接続を試みます。")
-                if 'ser' in locals() and ser.is_open:
-                    ser.close()
-                time.sleep(SERIAL_RETRY_INTERVAL)
+                logger.error(f"基線 {baseline.name} の計算で予期せぬエラー: {e}")
 
-# --- ヘディングと誤差の計算スレッド ---
-def calculate_heading_and_error_thread():
+def process_pair(baseline, pair):
+    # 1エポック分の基線の解を計算して公開する（計算自体は heading_solver に共通化）
+    primary = baseline is PRIMARY_BASELINE
+    base, rover = pair.fixes[baseline.base], pair.fixes[baseline.rover]
+    imu_status = sensor_data.current.imu_status
+
+    started = time.perf_counter()
+    metric_epoch_skew[baseline.name].observe(pair.skew)
+    solver = heading_solvers[baseline.name]
+    reason, result = solver.solve(pair.utc, base, rover)
+    if reason == REJECT_RESIDUAL:
+        metric_rejected[baseline.name, reason].inc()
+        logger.warning("基線長誤差が大きすぎるため除外しました（%s）: %sm", baseline.name, solver.last_error)
+        return
+    if reason is not None:
+        metric_rejected[baseline.name, reason].inc()
+        logger.warning("無効なGPSデータ（%s）: lat1=%s, lon1=%s, lat2=%s, lon2=%s, hdop_base=%s, hdop_rover=%s",
+                       baseline.name, base.lat, base.lon, rover.lat, rover.lon, base.hdop, rover.hdop)
+        return
+
+    calculated_heading, calculated_error, heading_sigma = result.heading, result.error, result.sigma
+    solution = BaselineSolution(
+        pair.utc, result.heading, result.smoothed, result.sigma, result.tilt, result.distance, result.error,
+        pair.skew, time.monotonic() - pair.completed_at
+    )
+
+    if primary:
+        # IMU-GPS融合: GPSヘディングでカルマンフィルターを補正（HDOP・基線長誤差が大きいほど信頼度を下げる）
+        if imu_status:
+            # HDOPの下限は平滑化の重み（HeadingWindow.weight）と同じ0.1
+            std = GPS_HEADING_STD * max(result.hdop, 0.1) * math.sqrt(1.0 + (calculated_error / SMOOTHING_RESIDUAL_SCALE) ** 2)
+            fused_heading = heading_fusion.correct(calculated_heading, std)
+            heading_sigma = heading_fusion.heading_std()
+        else:
+            heading_fusion.reset()
+            fused_heading = result.smoothed
+        snapshot = sensor_data.update_item(
+            'baselines', baseline.name, solution,
+            heading_gps=calculated_heading,
+            heading_fused=fused_heading,
+            heading_sigma=heading_sigma,
+            error=calculated_error,
+            distance=result.distance,
+            epoch_utc=pair.utc,
+            epoch_skew=pair.skew,
+            heading_latency=solution.latency
+        )
+    else:
+        snapshot = sensor_data.update_item('baselines', baseline.name, solution)
+    if calculated_error > MAX_BASELINE_ERROR:
+        metric_baseline_exceeded[baseline.name].inc()
+        logger.warning("基線長誤差が大きすぎます（%s）: %sm", baseline.name, calculated_error)
+
+    publish_solution(snapshot, history=primary)
+    metric_compute[baseline.name].observe(time.perf_counter() - started)
+    metric_gga_to_heading[baseline.name].observe(time.monotonic() - pair.completed_at)
+
+# --- API用ペイロード ---
+def position_payload(snapshot, version):
+    # 1つのスナップショットから組み立てるので、基準局・移動局の値は常に同じ時点のもの
+    # version: 解のバージョン（solution_version）
+    base, rover = snapshot.fix(PRIMARY_BASELINE.base), snapshot.fix(PRIMARY_BASELINE.rover)
+    return {
+        "lat": base.lat,
+        "lon": base.lon,
+        "heading": snapshot.heading_fused,  # 融合ヘディングを返す
+        "heading_sigma": snapshot.heading_sigma,
+        "distance": snapshot.distance,
+        "error": snapshot.error,
+        "imu": snapshot.imu_status,
+        "imu_raw_gyro_z": snapshot.imu_raw_gyro_z,
+        "hdop_base": base.hdop,
+        "hdop_rover": rover.hdop,
+        "quality_base": base.quality,
+        "quality_rover": rover.quality,
+        "num_sats_base": base.num_sats,
+        "num_sats_rover": rover.num_sats,
+        "utc": snapshot.epoch_utc,  # 解のエポック（UTC 0時からの秒）
+        "epoch_skew_ms": snapshot.epoch_skew * 1000,
+        "heading_latency_ms": snapshot.heading_latency * 1000,
+        "receivers": {
+            name: {"lat": fix.lat, "lon": fix.lon, "altitude": fix.altitude, "hdop": fix.hdop,
+                   "quality": fix.quality, "num_sats": fix.num_sats}
+            for name, fix in snapshot.fixes.items()
+        },
+        "baselines": {
+            name: {"utc": sol.utc, "heading": sol.heading, "smoothed": sol.smoothed, "sigma": sol.sigma,
+                   "tilt": sol.tilt, "distance": sol.distance,
+                   "error": sol.error, "epoch_skew_ms": sol.skew * 1000, "latency_ms": sol.latency * 1000}
+            for name, sol in snapshot.baselines.items()
+        },
+        "version": version
+    }
+
+def stats_payload():
+    # シリアル受信とエポック照合の統計
+    return {
+        "gps": {name: receiver.framer.stats() for name, receiver in RECEIVERS.items()},
+        "epochs": {
+            baseline.name: {
+                "matched": baseline.matcher.matched,
+                "unmatched": baseline.matcher.unmatched,
+                "dropped": baseline.matcher.dropped
+            }
+            for baseline in BASELINES
+        }
+    }
+
+def publish_solution(snapshot, history=True):
+    # 新しい解を1回だけシリアライズし、ストリーム購読中の全クライアントと共有メモリへ配信
+    # 履歴には主基線の解とIMUサンプルごとの融合ヘディングだけを残す
+    # 複数スレッドから呼ばれるため、バージョンの採番から配信までをまとめて直列化する（配信順とバージョン順を一致させる）
+    global solution_version
+    with solution_lock:
+        solution_version += 1
+        payload = position_cache.put(solution_version, position_payload(snapshot, solution_version)).json()
+        stream_broadcaster.publish(payload)
+        if shared_position_writer is not None:
+            shared_position_writer.write(payload, solution_version)
+    if history:
+        solution_history.append((
+            snapshot.heading_fused, snapshot.heading_gps, snapshot.error, snapshot.distance,
+            snapshot.fix(PRIMARY_BASELINE.base).hdop, snapshot.fix(PRIMARY_BASELINE.rover).hdop, snapshot.imu_raw_gyro_z
+        ))
+
+# --- 共有メモリ連携スレッド ---
+def publish_stats():
+    shared_stats_writer.write(json.dumps(stats_payload()).encode())
+    shared_metrics_writer.write(pipeline_metrics.render().encode())
+
+def publish_stats_thread():
     while True:
-        with sensor_data.lock:
-            lat1, lon1 = sensor_data.base_data['lat'], sensor_data.base_data['lon']
-            lat2, lon2 = sensor_data.rover_data['lat'], sensor_data.rover_data['lon']
-            hdop_base, hdop_rover = sensor_data.base_data['hdop'], sensor_data.rover_data['hdop']
-            imu_gyro_z = sensor_data.imu_raw_gyro_z
-            imu_status = sensor_data.imu_status
-
-        if lat1 == 0.0 or lon1 == 0.0 or lat2 == 0.0 or lon2 == 0.0 or hdop_base > HDOP_THRESHOLD or hdop_rover > HDOP_THRESHOLD:
-            logger.warning(f"無効なGPSデータ: lat1={lat1}, lon1={lon1}, lat2={lat2}, lon2={lon2}, hdop_base={hdop_base}, hdop_rover={hdop_rover}")
-            time.sleep(1)
-            continue
+        publish_stats()
+        time.sleep(STATS_PUBLISH_INTERVAL)
 
-        # Haversine公式で距離計算
-        phi1, lambda1 = math.radians(lat1), math.radians(lon1)
-        phi2, lambda2 = math.radians(lat2), math.radians(lon2)
-        d_phi, d_lambda = phi2 - phi1, lambda2 - lambda1
-        a = math.sin(d_phi / 2)**2 + math.cos(phi1) * math.cos(phi2) * math.sin(d_lambda / 2)**2
-        c = 2 * math.atan2(math.sqrt(a), math.sqrt(1 - a))
-        calculated_distance = EARTH_RADIUS_M * c
-
-        # ヘディング計算
-        y = math.sin(d_lambda) * math.cos(phi2)
-        x = math.cos(phi1) * math.sin(phi2) - math.sin(phi1) * math.cos(phi2) * math.cos(d_lambda)
-        calculated_heading = (math.degrees(math.atan2(y, x)) + 360) % 360
-
-        # 基線長誤差
-        calculated_error = abs(calculated_distance - BASELINE_LENGTH_METER)
-
-        # IMU-GPS融合（簡易補完フィルター）
-        ALPHA = 0.98  # IMUの信頼度
-        fused_heading = calculated_heading
-        if imu_status and abs(imu_gyro_z) > 0.05:
-            heading_change = imu_gyro_z * 0.5  # 0.5秒間隔を仮定
-            fused_heading = (ALPHA * (sensor_data.last_fused_heading + heading_change) + (1 - ALPHA) * calculated_heading + 360) % 360
-
-        with sensor_data.lock:
-            sensor_data.heading_gps = calculated_heading
-            sensor_data.heading_fused = fused_heading
-            sensor_data.last_fused_heading = fused_heading
-            sensor_data.error = calculated_error
-            sensor_data.distance = calculated_distance
-            if calculated_error > MAX_BASELINE_ERROR:
-                logger.warning(f"基線長誤差が大きすぎます: {calculated_error}m")
-
-        time.sleep(0.5)
+def shared_state_poll_thread():
+    # Webワーカー: 共有メモリのバージョンを監視し、更新があればこのワーカーのストリーム購読者へ配信
+    last_version = 0
+    while True:
+        try:
+            version = shared_position_reader.version()
+            if version != last_version:
+                version, payload = shared_position_reader.read()
+                if payload is not None:
+                    stream_broadcaster.publish(payload)
+                last_version = version
+        except Exception as e:
+            logger.error(f"共有メモリの読み取りでエラー: {e}")
+        time.sleep(SHARED_STATE_POLL_INTERVAL)
 
 # --- スレッド起動 ---
-threading.Thread(target=read_gps_thread, args=(GPS_BASE_PORT, 'base'), daemon=True).start()
-threading.Thread(target=read_gps_thread, args=(GPS_ROVER_PORT, 'rover'), daemon=True).start()
-threading.Thread(target=calculate_heading_and_error_thread, daemon=True).start()
-if IMU_AVAILABLE:
-    threading.Thread(target=read_imu_thread, daemon=True).start()
+if DEPLOY_ROLE == 'web':
+    # ハードウェアには触れず、取得プロセスが共有メモリへ書き込んだ解を読むだけ
+    threading.Thread(target=shared_state_poll_thread, daemon=True).start()
+elif ACQUISITION_ENGINE == 'asyncio':
+    # 受信・IMU・計算・統計の書き出しを1つのイベントループ（1スレッド）で処理する
+    acquisition_engine = AsyncAcquisition(
+        RECEIVERS.values(), BASELINES, receive_data, process_pair, SERIAL_RETRY_INTERVAL, SERIAL_RETRY_MAX_INTERVAL
+    )
+    if IMU_AVAILABLE:
+        acquisition_engine.every(IMU_READ_INTERVAL, sample_imu)
+    if shared_stats_writer is not None:
+        acquisition_engine.every(STATS_PUBLISH_INTERVAL, publish_stats)
+    if ASYNC_STREAM_PORT:
+        acquisition_engine.serve_stream(
+            '0.0.0.0', ASYNC_STREAM_PORT, lambda: latest_position().json(), stream_broadcaster
+        )
+    pipeline_metrics.callback(
+        'imu_timer_overruns_total', "周期に間に合わず飛ばしたIMUサンプリング・統計書き出しの回数",
+        lambda: acquisition_engine.timer_overruns, kind='counter'
+    )
+    threading.Thread(target=acquisition_engine.run, name='acquisition-loop', daemon=True).start()
+else:
+    if DUMMY_MODE:
+        threading.Thread(target=dummy_gps_thread, daemon=True).start()
+    elif replay_source is None:
+        threading.Thread(target=read_gps_thread, daemon=True).start()
+    if not REPLAY_INLINE:
+        for baseline in BASELINES:
+            threading.Thread(target=calculate_heading_and_error_thread, args=(baseline,), daemon=True).start()
+    if IMU_AVAILABLE:
+        threading.Thread(target=read_imu_thread, daemon=True).start()
+    if replay_source is not None:
+        replay_source.start(replay_data)
+    if shared_stats_writer is not None:
+        threading.Thread(target=publish_stats_thread, daemon=True).start()
 
 # --- Flask Webアプリケーション ---
 @app.route("/")
 def index():
     return render_template("index.html")
 
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+@app.after_request
+def record_request_time(response):
+    if request.endpoint == 'api_position' and 'since' in request.args:
+        histogram = metric_api_long_poll
+    else:
+        histogram = metric_api.get(request.endpoint)
+    if histogram is not None:
+        histogram.observe(time.perf_counter() - g.request_started)
+    return response
+
+@app.route("/metrics")
+def metrics():
+    # Prometheusテキスト形式。web ワーカーでは取得プロセスが書き出した取得・計算側のメトリクスを連結する
+    if shared_metrics_reader is not None:
+        _, pipeline_text = shared_metrics_reader.read()
+        pipeline_text = (pipeline_text or b'').decode()
+    else:
+        pipeline_text = pipeline_metrics.render()
+    return Response(pipeline_text + web_metrics.render(), mimetype="text/plain; version=0.0.4")
+
+def latest_position():
+    # 最新の解（まだ解がなければ現在の状態をバージョン0として返す）
+    entry = position_cache.latest()
+    if entry is None:
+        entry = CachedPosition(0, position_payload(sensor_data.current, 0))
+    return entry
+
 @app.route("/api/position")
 def api_position():
-    with sensor_data.lock:
-        data = {
-            "lat": sensor_data.base_data['lat'],
-            "lon": sensor_data.base_data['lon'],
-            "heading": sensor_data.heading_fused,  # 融合ヘディングを返す
-            "distance": sensor_data.distance,
-            "error": sensor_data.error,
-            "imu": sensor_data.imu_status,
-            "imu_raw_gyro_z": sensor_data.imu_raw_gyro_z,
-            "hdop_base": sensor_data.base_data['hdop'],
-            "hdop_rover": sensor_data.rover_data['hdop']
-        }
-    return jsonify(data)
+    # format=bin: 固定長バイナリ（position_codec.POSITION_BIN）
+    # since=N: X-Position-Version が N より新しくなるまで最大 timeout 秒待つ（ロングポーリング。タイムアウト時は 304）
+    #   N が現在のバージョンより大きければ再起動前（共有メモリの消去前）の値なので、待たずに現在の解を返す
+    # If-None-Match に前回の ETag を指定すると、更新がなければ 304 を返す
+    binary = request.args.get('format') == 'bin'
+    try:
+        since = request.args.get('since')
+        since = int(since) if since is not None else None
+        timeout = min(float(request.args.get('timeout', POSITION_LONG_POLL_TIMEOUT)), POSITION_LONG_POLL_MAX_TIMEOUT)
+    except ValueError:
+        return jsonify({"error": "since と timeout は数値で指定してください"}), 400
+
+    if shared_position_reader is not None:
+        version = shared_position_reader.version()
+        if since is not None and version == since:
+            deadline = time.monotonic() + timeout
+            while version == since and time.monotonic() < deadline:
+                time.sleep(SHARED_STATE_POLL_INTERVAL)
+                version = shared_position_reader.version()
+        entry = position_cache.lookup(version)
+        if entry is None:
+            version, payload = shared_position_reader.read()
+            if payload is None:
+                return jsonify({"error": "取得プロセスからのデータがまだありません"}), 503
+            entry = position_cache.put(version, json_bytes=payload)
+    else:
+        entry = latest_position()
+        if since is not None and entry.version == since:
+            entry = position_cache.wait(since, timeout) or entry
+
+    etag = f"{POSITION_ETAG_PREFIX}{entry.version}{'b' if binary else 'j'}"
+    headers = {"X-Position-Version": str(entry.version), "Cache-Control": "no-cache"}
+    if (since is not None and entry.version == since) or etag in request.if_none_match:
+        response = Response(status=304, headers=headers)
+    elif binary:
+        response = Response(entry.bin(), mimetype="application/octet-stream", headers=headers)
+    else:
+        response = Response(entry.json(), mimetype="application/json", headers=headers)
+    response.set_etag(etag)
+    return response
+
+@app.route("/api/stats")
+def api_stats():
+    if shared_stats_reader is not None:
+        return shared_state_response(shared_stats_reader)
+    return jsonify(stats_payload())
+
+def shared_state_response(reader):
+    # 取得プロセスがシリアライズ済みのJSONをそのまま返す
+    _, payload = reader.read()
+    if payload is None:
+        return jsonify({"error": "取得プロセスからのデータがまだありません"}), 503
+    return Response(payload, mimetype="application/json")
+
+@app.route("/api/history")
+def api_history():
+    # 直近 window 秒を buckets 区間に分けた最小・最大・平均（列指向）
+    # format=bin: t(float64), count(uint32), 各列の min/max/mean(float32) をこの順に連結したバイナリ
+    global solution_history
+    if solution_history is None:
+        solution_history = SolutionHistory.open_reader(SHARED_STATE_PATH + '.history')
+        if solution_history is None:
+            return jsonify({"error": "取得プロセスからのデータがまだありません"}), 503
+    try:
+        window = float(request.args.get('window', 600))
+        buckets = min(int(request.args.get('buckets', 300)), HISTORY_MAX_BUCKETS)
+    except ValueError:
+        return jsonify({"error": "window と buckets は数値で指定してください"}), 400
+    fields = [f for f in request.args.get('fields', ','.join(HISTORY_FIELDS)).split(',') if f]
+    unknown = [f for f in fields if f not in HISTORY_FIELDS]
+    if unknown or window <= 0 or buckets <= 0:
+        return jsonify({"error": f"不正な指定です: {','.join(unknown) or 'window/buckets'}", "fields": HISTORY_FIELDS}), 400
+
+    result = solution_history.query(window, buckets, fields)
+    if request.args.get('format') == 'bin':
+        columns = ['t', 'count'] + [f"{f}.{stat}" for f in fields for stat in ('min', 'max', 'mean')]
+        body = result['t'].astype('<f8').tobytes() + result['count'].astype('<u4').tobytes() + b''.join(
+            result[f][stat].astype('<f4').tobytes() for f in fields for stat in ('min', 'max', 'mean')
+        )
+        return Response(body, mimetype="application/octet-stream", headers={"X-History-Columns": ','.join(columns)})
+    return jsonify({
+        "t": result['t'].tolist(),
+        "count": result['count'].tolist(),
+        **{f: {stat: values.tolist() for stat, values in result[f].items()} for f in fields}
+    })
+
+@app.route("/api/stream")
+def api_stream():
+    # Server-Sent Events: 新しい解が計算されるたびにプッシュする
+    return Response(
+        stream_broadcaster.stream(),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
 
 if __name__ == "__main__":
+    if DEPLOY_ROLE == 'acquisition':
+        # 取得専用プロセス: Webサーバーは起動せず、共有メモリへの書き込みを続ける
+        logger.info(f"取得プロセスとして起動しました（共有メモリ: {SHARED_STATE_PATH}）。")
+        while True:
+            time.sleep(3600)
     app.run(debug=True, use_reloader=False, host="0.0.0.0")
@@ -0,0 +1,201 @@
+import asyncio
+import logging
+import os
+
+import serial
+
+logger = logging.getLogger(__name__)
+
+# --- asyncioによる取得エンジン ---
+# 全受信機のシリアルポート、IMUの周期サンプリング、基線ごとのヘディング計算、ストリーム配信を
+# 1つのイベントループ（1スレッド）で処理する。
+# - シリアル: loop.add_reader で受信時だけ起床する（ポーリングの sleep なし）
+# - 再接続: 受信機ごとに指数バックオフ。待機中も他の受信機の処理は止まらない
+# - 周期処理: 開始時刻からの絶対時刻で次回を決め、処理時間による周期のずれを蓄積させない
+# - 計算: 受信データの処理後に基線ごとのイベントを立て、待機中の計算タスクが揃ったエポックを処理する
+
+HEARTBEAT_INTERVAL = 15.0  # ストリーム無通信時にコメント行を送る間隔（秒）
+MAX_REQUEST_HEADER = 8192
+
+
+class AsyncAcquisition:
+    def __init__(self, receivers, baselines, on_data, on_pair, retry_interval=1.0, max_retry_interval=60.0):
+        # on_data(receiver, data): 受信したバイト列の処理 / on_pair(baseline, pair): 揃ったエポックの計算
+        self.receivers = list(receivers)
+        self.baselines = list(baselines)
+        self.on_data = on_data
+        self.on_pair = on_pair
+        self.retry_interval = retry_interval
+        self.max_retry_interval = max_retry_interval
+        self._periodic = []
+        self._stream = None
+        self._loop = None
+        self._events = {}
+        self._frame = None
+        self._frame_changed = None
+        # 統計
+        self.timer_overruns = 0  # 周期処理が間に合わず飛ばした回数
+        self.stream_clients = 0
+
+    def every(self, interval, func):
+        # func を interval 秒周期で呼ぶ（run の前に登録する）
+        self._periodic.append((interval, func))
+
+    def serve_stream(self, host, port, position, broadcaster):
+        # /api/stream（SSE）と /api/position をこのイベントループで配信する
+        # position(): シリアライズ済みの最新解（bytes）。broadcaster: 配信するフレームの発行元
+        self._stream = (host, port, position)
+        broadcaster.add_listener(self._on_frame_threadsafe)
+
+    def run(self):
+        asyncio.run(self._main())
+
+    async def _main(self):
+        self._loop = asyncio.get_running_loop()
+        self._frame_changed = asyncio.Event()
+        tasks = [self._receiver_task(r) for r in self.receivers]
+        for baseline in self.baselines:
+            self._events[baseline.name] = asyncio.Event()
+            tasks.append(self._baseline_task(baseline))
+        tasks += [self._periodic_task(interval, func) for interval, func in self._periodic]
+        if self._stream is not None:
+            host, port, _ = self._stream
+            server = await asyncio.start_server(self._handle_client, host, port)
+            logger.info(f"ストリーム配信を {host}:{port} で開始しました。")
+            tasks.append(server.serve_forever())
+        await asyncio.gather(*tasks)
+
+    # --- シリアル受信 ---
+    def _open(self, receiver):
+        if not os.path.exists(receiver.port):
+            raise serial.SerialException("ポートが見つかりません")
+        return serial.Serial(receiver.port, receiver.baudrate, timeout=0)
+
+    async def _receiver_task(self, receiver):
+        delay = self.retry_interval
+        while True:
+            try:
+                receiver.serial = self._open(receiver)
+            except (serial.SerialException, OSError) as e:
+                logger.error(f"GPSポート {receiver.port} を開けません: {e}。{delay}秒後に再試行します。")
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, self.max_retry_interval)
+                continue
+            logger.info(f"GPSポート {receiver.port}（{receiver.name}）が正常に開かれました。")
+            delay = self.retry_interval
+            closed = self._loop.create_future()
+            fd = receiver.serial.fileno()
+            self._loop.add_reader(fd, self._on_readable, receiver, closed)
+            try:
+                await closed
+            finally:
+                self._loop.remove_reader(fd)
+                try:
+                    receiver.serial.close()
+                except OSError:
+                    pass
+                receiver.serial = None
+            await asyncio.sleep(delay)
+
+    def _on_readable(self, receiver, closed):
+        try:
+            data = receiver.serial.read(receiver.serial.in_waiting or 1)
+        except (serial.SerialException, OSError) as e:
+            # USBの抜去では in_waiting（ioctl）が OSError(EIO) を送出する。fd の監視を外して再接続へ
+            logger.error(f"GPSポート {receiver.port} でシリアル通信エラー: {e}。再接続を試みます。")
+            self._loop.remove_reader(receiver.serial.fileno())  # 再接続タスクが動くまでに再度呼ばれないように
+            if not closed.done():
+                closed.set_result(None)
+            return
+        if not data:
+            return
+        try:
+            self.on_data(receiver, data)
+        except Exception as e:
+            logger.error(f"GPSポート {receiver.port} で予期せぬエラー: {e}。")
+        for baseline in receiver.baselines:
+            self._events[baseline.name].set()
+
+    # --- ヘディング計算 ---
+    async def _baseline_task(self, baseline):
+        event = self._events[baseline.name]
+        while True:
+            await event.wait()
+            event.clear()
+            while True:
+                pair = baseline.matcher.wait_pair(timeout=0)
+                if pair is None:
+                    break
+                try:
+                    self.on_pair(baseline, pair)
+                except Exception as e:
+                    logger.error(f"基線 {baseline.name} の計算で予期せぬエラー: {e}")
+
+    # --- 周期処理 ---
+    async def _periodic_task(self, interval, func):
+        next_time = self._loop.time()
+        while True:
+            try:
+                func()
+            except Exception as e:
+                logger.error(f"周期処理 {getattr(func, '__name__', func)} でエラー: {e}")
+            next_time += interval
+            delay = next_time - self._loop.time()
+            if delay < 0:
+                # 間に合わなかった周期は飛ばし、位相は開始時刻基準のまま保つ
+                missed = int(-delay // interval) + 1
+                self.timer_overruns += missed
+                next_time += missed * interval
+                delay = next_time - self._loop.time()
+            await asyncio.sleep(delay)
+
+    # --- ストリーム配信 ---
+    def _on_frame_threadsafe(self, frame):
+        self._loop.call_soon_threadsafe(self._on_frame, frame)
+
+    def _on_frame(self, frame):
+        self._frame = frame
+        self._frame_changed.set()
+        self._frame_changed = asyncio.Event()
+
+    async def _handle_client(self, reader, writer):
+        try:
+            header = await reader.readuntil(b'\r\n\r\n')
+            if len(header) > MAX_REQUEST_HEADER:
+                return
+            method, _, rest = header.partition(b' ')
+            path = rest.split(b' ', 1)[0].split(b'?', 1)[0]
+            if method != b'GET':
+                writer.write(b'HTTP/1.1 405 Method Not Allowed\r\nContent-Length: 0\r\nConnection: close\r\n\r\n')
+            elif path == b'/api/position':
+                body = self._stream[2]()
+                writer.write(b'HTTP/1.1 200 OK\r\nContent-Type: application/json\r\nContent-Length: %d\r\n'
+                             b'Connection: close\r\n\r\n%s' % (len(body), body))
+            elif path == b'/api/stream':
+                await self._stream_events(writer)
+            else:
+                writer.write(b'HTTP/1.1 404 Not Found\r\nContent-Length: 0\r\nConnection: close\r\n\r\n')
+            await writer.drain()
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def _stream_events(self, writer):
+        writer.write(b'HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\nCache-Control: no-cache\r\n'
+                     b'X-Accel-Buffering: no\r\nConnection: close\r\n\r\n')
+        self.stream_clients += 1
+        try:
+            if self._frame is not None:
+                writer.write(self._frame)
+            while True:
+                # 常に最新フレームだけを送る（遅いクライアントは途中のフレームを読み飛ばす）
+                changed = self._frame_changed
+                try:
+                    await asyncio.wait_for(changed.wait(), HEARTBEAT_INTERVAL)
+                    writer.write(self._frame)
+                except asyncio.TimeoutError:
+                    writer.write(b': keepalive\n\n')
+                await writer.drain()
+        finally:
+            self.stream_clients -= 1
@@ -0,0 +1,68 @@
+# --- 測地計算のスループット比較 ---
+# 使い方: python3 bench/bench_geodesy.py [--pairs N]
+# スカラー版（1組ずつ）とNumPyバッチ版の処理速度（組/秒）を球面・ENU近似それぞれで比較する。
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+import geodesy
+
+BASELINE_LENGTH_METER = 0.7
+
+
+def make_pairs(n):
+    # 東京駅付近で、基線長0.7m前後・任意方位の基準局/移動局の組を生成
+    rnd = np.random.default_rng(0)
+    lat1 = 35.681 + rnd.uniform(-0.001, 0.001, n)
+    lon1 = 139.767 + rnd.uniform(-0.001, 0.001, n)
+    bearing = rnd.uniform(0, 2 * np.pi, n)
+    dist = BASELINE_LENGTH_METER + rnd.normal(0, 0.02, n)
+    lat2 = lat1 + np.degrees(dist * np.cos(bearing) / geodesy.EARTH_RADIUS_M)
+    lon2 = lon1 + np.degrees(dist * np.sin(bearing) / (geodesy.EARTH_RADIUS_M * np.cos(np.radians(lat1))))
+    return lat1, lon1, lat2, lon2
+
+
+def bench(label, func, n, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - t0)
+    print(f"{label:<32} {n / best:>14,.0f} 組/秒")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="geodesy スカラー版とバッチ版の比較")
+    parser.add_argument('--pairs', type=int, default=1_000_000)
+    parser.add_argument('--scalar-pairs', type=int, default=100_000, help="スカラー版で計測する組数")
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    lat1, lon1, lat2, lon2 = make_pairs(args.pairs)
+    ns = min(args.scalar_pairs, args.pairs)
+    s_lat1, s_lon1, s_lat2, s_lon2 = (a[:ns].tolist() for a in (lat1, lon1, lat2, lon2))
+
+    def scalar(func):
+        return lambda: [func(a, b, c, d, BASELINE_LENGTH_METER) for a, b, c, d in zip(s_lat1, s_lon1, s_lat2, s_lon2)]
+
+    def batch(func):
+        return lambda: func(lat1, lon1, lat2, lon2, BASELINE_LENGTH_METER)
+
+    bench("baseline（スカラー）", scalar(geodesy.baseline), ns, args.repeat)
+    bench("baseline_batch（NumPy）", batch(geodesy.baseline_batch), args.pairs, args.repeat)
+    bench("baseline_enu（スカラー）", scalar(geodesy.baseline_enu), ns, args.repeat)
+    bench("baseline_enu_batch（NumPy）", batch(geodesy.baseline_enu_batch), args.pairs, args.repeat)
+
+    # 球面計算とENU近似の差（短基線での近似誤差の確認）
+    d1, b1, _ = geodesy.baseline_batch(lat1, lon1, lat2, lon2, BASELINE_LENGTH_METER)
+    d2, b2, _ = geodesy.baseline_enu_batch(lat1, lon1, lat2, lon2, BASELINE_LENGTH_METER)
+    db = np.abs((b1 - b2 + 180) % 360 - 180)
+    print(f"ENU近似との差: 距離 最大 {np.max(np.abs(d1 - d2)) * 1000:.3f} mm, 方位角 最大 {np.max(db):.4f}°")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+# --- GGAデコーダーのマイクロベンチマーク ---
+# 使い方: python3 bench/bench_nmea_parser.py [NMEAログファイル ...]
+# ファイルを指定しない場合は、GGA/RMC/GSA/GSVを含む合成コーパスを使用する。
+import argparse
+import functools
+import operator
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pynmea2
+import nmea_parser
+from nmea_reader import nmea_checksum_ok
+
+
+def _sentence(body):
+    checksum = functools.reduce(operator.xor, body.encode('ascii'), 0)
+    return f"${body}*{checksum:02X}".encode('ascii')
+
+
+def synthetic_corpus(epochs=2000):
+    # 10Hz受信機の1エポック分: GGA, RMC, GSA, GSV x3
+    out = []
+    rnd = random.Random(0)
+    for i in range(epochs):
+        utc = 3600.0 + i * 0.1
+        hh, mm, ss = int(utc // 3600), int(utc % 3600 // 60), utc % 60
+        t = f"{hh:02d}{mm:02d}{ss:05.2f}"
+        lat = 3540.0 + rnd.uniform(0.8, 0.9)
+        lon = 13946.0 + rnd.uniform(0.0, 0.1)
+        out.append(_sentence(f"GPGGA,{t},{lat:.5f},N,{lon:.5f},E,4,12,{rnd.uniform(0.6, 1.5):.1f},40.0,M,39.0,M,1.0,0000"))
+        out.append(_sentence(f"GPRMC,{t},A,{lat:.5f},N,{lon:.5f},E,0.02,,230394,,,D"))
+        out.append(_sentence("GPGSA,A,3,01,02,12,14,15,17,19,24,25,32,,,1.6,0.9,1.3"))
+        for n in range(3):
+            out.append(_sentence(f"GPGSV,3,{n + 1},12,01,40,083,46,02,17,308,41,12,07,344,39,14,22,228,45"))
+    return out
+
+
+def load_corpus(paths):
+    out = []
+    for path in paths:
+        with open(path, 'rb') as f:
+            for line in f:
+                line = line.strip()
+                start = line.find(b'$')
+                if start >= 0 and nmea_checksum_ok(line[start:]):
+                    out.append(line[start:])
+    return out
+
+
+def run(label, func, sentences, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        for s in sentences:
+            func(s)
+        best = min(best, time.perf_counter() - t0)
+    rate = len(sentences) / best
+    print(f"{label:<28} {rate:>12,.0f} 文/秒  {1e6 / rate:8.2f} µs/文")
+    return rate
+
+
+def pynmea2_gga(sentence):
+    msg = pynmea2.parse(sentence.decode('ascii'))
+    return msg.latitude, msg.longitude, float(msg.horizontal_dil), msg.timestamp
+
+
+def main():
+    parser = argparse.ArgumentParser(description="高速NMEAデコーダーとpynmea2の比較")
+    parser.add_argument('files', nargs='*', help="NMEAログファイル（省略時は合成コーパス）")
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    corpus = load_corpus(args.files) if args.files else synthetic_corpus()
+    gga = [s for s in corpus if s[3:6] == b'GGA']
+    print(f"コーパス: {len(corpus)} 文（GGA {len(gga)} 文）")
+    if not gga:
+        sys.exit("GGA文が見つかりません")
+
+    fast = run("nmea_parser.parse_gga", nmea_parser.parse_gga, gga, args.repeat)
+    slow = run("pynmea2.parse + 属性参照", pynmea2_gga, gga, args.repeat)
+    print(f"速度比: {fast / slow:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,399 @@
+# --- 取得〜API配信パイプラインの負荷試験 ---
+# 使い方: python3 bench/bench_pipeline.py [--rates 1,10,50] [--bauds 9600,115200] [--clients 0,16] [--engines threads,asyncio]
+#                                          [--output result.json]
+# 疑似端末（pty）を仮想シリアルポートとして基準局・移動局のNMEA（GGA+RMC）を指定レート・ボーレート相当で送り込み、
+# app1.py（standalone）の read_gps_thread から /api/stream までを実際に動かして計測する。
+# 同時に別プロセスのクライアントから /api/position へリクエストを送り続ける。
+# 結果（受信スループット、取りこぼし、エンドツーエンド遅延のパーセンタイル、スレッド別CPU、RSS）は
+# JSONで出力するので、バージョン間の比較に使える。Linux専用（/proc を参照する）。
+import argparse
+import configparser
+import functools
+import http.client
+import itertools
+import json
+import logging
+import math
+import multiprocessing
+import operator
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tty
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+from epoch_matcher import utc_key
+import geodesy
+
+BASELINE_LENGTH_METER = 0.7
+START_UTC = 3600.0
+CLOCK_TICKS = os.sysconf('SC_CLK_TCK')
+
+
+# --- NMEA生成 ---
+def _sentence(body):
+    checksum = functools.reduce(operator.xor, body.encode('ascii'), 0)
+    return f"${body}*{checksum:02X}\r\n".encode('ascii')
+
+
+def _nmea_coord(value, width):
+    degrees = int(value)
+    return f"{degrees:0{width}d}{(value - degrees) * 60:08.5f}"
+
+
+def epoch_sentences(utc, lat, lon):
+    # 受信機1台の1エポック分: GGA（処理対象）+ RMC（フィルターで捨てられる文）
+    hh, mm, ss = int(utc // 3600), int(utc % 3600 // 60), utc % 60
+    t = f"{hh:02d}{mm:02d}{ss:05.2f}"
+    lat_s, lon_s = _nmea_coord(lat, 2), _nmea_coord(lon, 3)
+    return (
+        _sentence(f"GPGGA,{t},{lat_s},N,{lon_s},E,4,12,0.8,40.0,M,39.0,M,1.0,0000")
+        + _sentence(f"GPRMC,{t},A,{lat_s},N,{lon_s},E,0.02,,230394,,,D")
+    )
+
+
+def rover_position(lat, lon, bearing_deg):
+    bearing = math.radians(bearing_deg)
+    dlat = BASELINE_LENGTH_METER * math.cos(bearing) / geodesy.EARTH_RADIUS_M
+    dlon = BASELINE_LENGTH_METER * math.sin(bearing) / (geodesy.EARTH_RADIUS_M * math.cos(math.radians(lat)))
+    return lat + math.degrees(dlat), lon + math.degrees(dlon)
+
+
+class Feeder(threading.Thread):
+    # 1台の受信機を模擬し、pty のマスター側へ書き込む。
+    # ボーレートは1バイト=10ビットとして送信完了時刻まで待ってから書き込むことで再現する。
+    # 回線が詰まって次のエポックに間に合わない場合は、実機と同様にそのエポックを出力しない。
+    def __init__(self, key, fd, rate, baud, sent_times, stop):
+        super().__init__(name=f"feeder-{key}", daemon=True)
+        self.key, self.fd, self.rate, self.baud = key, fd, rate, baud
+        self.sent_times, self.stop = sent_times, stop
+        self.epochs = self.sentences = self.bytes = self.skipped = 0
+
+    def run(self):
+        interval = 1.0 / self.rate
+        bytes_per_sec = self.baud / 10.0
+        start = time.monotonic()
+        line_free = start
+        for i in itertools.count():
+            if self.stop.is_set():
+                return
+            scheduled = start + i * interval
+            if line_free > scheduled + interval:
+                self.skipped += 1
+                continue
+            utc = START_UTC + i * interval
+            lat, lon = 35.681, 139.767
+            if self.key == 'rover':
+                lat, lon = rover_position(lat, lon, i % 360)
+            data = epoch_sentences(utc, lat, lon)
+            line_free = max(scheduled, line_free) + len(data) / bytes_per_sec
+            delay = line_free - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            os.write(self.fd, data)
+            self.sent_times.setdefault(utc_key(utc), {})[self.key] = time.monotonic()
+            self.epochs += 1
+            self.sentences += 2
+            self.bytes += len(data)
+
+    def counters(self):
+        return {"epochs": self.epochs, "sentences": self.sentences, "bytes": self.bytes, "skipped": self.skipped}
+
+
+# --- サーバープロセス（app1 を standalone で起動） ---
+def serve(config_path, ready):
+    os.environ['GPS_COMPASS_CONFIG'] = config_path
+    os.environ['GPS_COMPASS_ROLE'] = 'standalone'
+    import app1
+    from werkzeug.serving import make_server
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)  # アクセスログを出さない
+    server = make_server('127.0.0.1', 0, app1.app, threaded=True)
+    threads = {t.native_id: t.name for t in threading.enumerate()}
+    ready.put((server.server_port, threads))
+    server.serve_forever()
+
+
+def thread_cpu_ticks(pid):
+    ticks = {}
+    for tid in os.listdir(f'/proc/{pid}/task'):
+        try:
+            with open(f'/proc/{pid}/task/{tid}/stat') as f:
+                fields = f.read().rsplit(')', 1)[1].split()
+        except FileNotFoundError:
+            continue  # 終了したスレッド
+        ticks[int(tid)] = int(fields[11]) + int(fields[12])  # utime + stime
+    return ticks
+
+
+def process_cpu_ticks(pid):
+    with open(f'/proc/{pid}/stat') as f:
+        fields = f.read().rsplit(')', 1)[1].split()
+    return int(fields[11]) + int(fields[12])
+
+
+def process_memory(pid):
+    memory = {}
+    with open(f'/proc/{pid}/status') as f:
+        for line in f:
+            if line.startswith(('VmRSS:', 'VmHWM:')):
+                name, value, _ = line.split()
+                memory[name[:-1]] = int(value) / 1024
+    return {"rss_mb": memory.get('VmRSS'), "peak_rss_mb": memory.get('VmHWM')}
+
+
+# --- クライアント ---
+def percentiles(values, points=(50, 90, 99)):
+    if not values:
+        return {f"p{p}": None for p in points} | {"max": None}
+    values = sorted(values)
+    result = {f"p{p}": values[min(len(values) - 1, int(len(values) * p / 100))] for p in points}
+    result["max"] = values[-1]
+    return result
+
+
+def hammer(port, clients, duration, results):
+    # /api/position を clients 本のスレッドから連続で要求する（別プロセスで実行し、計測側のGILを汚さない）
+    latencies, errors = [], [0]
+    deadline = time.monotonic() + duration
+
+    def worker():
+        conn = http.client.HTTPConnection('127.0.0.1', port, timeout=5)
+        while time.monotonic() < deadline:
+            t0 = time.perf_counter()
+            try:
+                conn.request('GET', '/api/position')
+                response = conn.getresponse()
+                response.read()
+                if response.status != 200:
+                    errors[0] += 1
+                    continue
+            except (OSError, http.client.HTTPException):
+                errors[0] += 1
+                conn.close()
+                continue
+            latencies.append(time.perf_counter() - t0)
+
+    workers = [threading.Thread(target=worker) for _ in range(clients)]
+    for w in workers:
+        w.start()
+    for w in workers:
+        w.join()
+    results.put({
+        "requests": len(latencies),
+        "requests_per_sec": len(latencies) / duration,
+        "errors": errors[0],
+        "latency_ms": {k: v * 1000 if v is not None else None for k, v in percentiles(latencies).items()},
+    })
+
+
+class StreamWatcher(threading.Thread):
+    # /api/stream を購読し、解のエポックが両受信機から送り終わってから届くまでの時間を記録する
+    def __init__(self, port, sent_times):
+        super().__init__(name="stream-watcher", daemon=True)
+        self.port, self.sent_times = port, sent_times
+        self.recording = False
+        self.latencies = []
+
+    def run(self):
+        conn = http.client.HTTPConnection('127.0.0.1', self.port)
+        conn.request('GET', '/api/stream')
+        response = conn.getresponse()
+        while True:
+            line = response.fp.readline()
+            if not line:
+                return
+            if not line.startswith(b'data: '):
+                continue
+            received = time.monotonic()
+            utc = json.loads(line[6:]).get('utc')
+            sent = self.sent_times.get(utc_key(utc)) if utc is not None else None
+            if self.recording and sent is not None and len(sent) == 2:
+                self.latencies.append(received - max(sent.values()))
+
+
+def get_json(port, path):
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=5)
+    conn.request('GET', path)
+    return json.loads(conn.getresponse().read())
+
+
+# --- 1シナリオの実行 ---
+def write_config(path, base_port, rover_port, baud, engine, log_path):
+    config = configparser.ConfigParser()
+    config.read(os.path.join(REPO_DIR, 'config.ini'))
+    config['General']['DummyMode'] = 'false'
+    config['GPS']['Baudrate'] = str(baud)
+    config['Receivers'] = {'base': base_port, 'rover': rover_port}
+    config['Baselines'] = {'main': f'base, rover, {BASELINE_LENGTH_METER}'}
+    config['Logging']['File'] = log_path
+    config['Deploy']['Engine'] = engine
+    config['Record']['File'] = ''
+    config['Replay']['File'] = ''
+    with open(path, 'w') as f:
+        config.write(f)
+
+
+def open_pty():
+    master, slave = os.openpty()
+    tty.setraw(slave)
+    return master, slave, os.ttyname(slave)
+
+
+def run_scenario(rate, baud, clients, engine, duration, warmup, workdir):
+    ctx = multiprocessing.get_context('spawn')
+    ptys = {key: open_pty() for key in ('base', 'rover')}
+    config_path = os.path.join(workdir, 'config.ini')
+    write_config(config_path, ptys['base'][2], ptys['rover'][2], baud, engine, os.path.join(workdir, 'app.log'))
+
+    ready = ctx.Queue()
+    server = ctx.Process(target=serve, args=(config_path, ready), daemon=True)
+    server.start()
+    try:
+        port, thread_names = ready.get(timeout=30)
+        sent_times, stop = {}, threading.Event()
+        feeders = [Feeder(key, ptys[key][0], rate, baud, sent_times, stop) for key in ('base', 'rover')]
+        watcher = StreamWatcher(port, sent_times)
+        watcher.start()
+        for feeder in feeders:
+            feeder.start()
+        time.sleep(warmup)
+
+        # --- 計測区間 ---
+        client_results = ctx.Queue()
+        client_proc = None
+        if clients:
+            client_proc = ctx.Process(target=hammer, args=(port, clients, duration, client_results), daemon=True)
+            client_proc.start()
+        stats_start = get_json(port, '/api/stats')
+        sent_start = [f.counters() for f in feeders]
+        threads_start, process_start = thread_cpu_ticks(server.pid), process_cpu_ticks(server.pid)
+        watcher.recording = True
+        t0 = time.monotonic()
+        time.sleep(duration)
+        elapsed = time.monotonic() - t0
+        watcher.recording = False
+        threads_end, process_end = thread_cpu_ticks(server.pid), process_cpu_ticks(server.pid)
+        sent_end = [f.counters() for f in feeders]
+        stats_end = get_json(port, '/api/stats')
+        memory = process_memory(server.pid)
+        http_result = None
+        if client_proc is not None:
+            http_result = client_results.get(timeout=duration + 30)
+            client_proc.join()
+        stop.set()
+        for feeder in feeders:
+            feeder.join()
+    finally:
+        server.terminate()
+        server.join()
+        for master, slave, _ in ptys.values():
+            os.close(master)
+            os.close(slave)
+
+    ports = {}
+    for feeder, before, after in zip(feeders, sent_start, sent_end):
+        received = {k: stats_end['gps'][feeder.key][k] - stats_start['gps'][feeder.key][k] for k in stats_end['gps'][feeder.key]}
+        sent = {k: after[k] - before[k] for k in after}
+        ports[feeder.key] = {
+            "sent_sentences": sent['sentences'],
+            "received_sentences": received['sentences'],
+            "sentences_per_sec": received['sentences'] / elapsed,
+            "dropped_sentences": max(0, sent['sentences'] - received['sentences']),
+            "checksum_failures": received['checksum_failures'],
+            "overruns": received['overruns'],
+            "epochs_skipped_by_baud": sent['skipped'],
+            "line_utilization": sent['bytes'] * 10 / baud / elapsed,
+        }
+    epochs = {k: stats_end['epochs']['main'][k] - stats_start['epochs']['main'][k] for k in stats_end['epochs']['main']}
+
+    # 起動時からあるスレッドは名前ごとに集計し、残り（リクエストごとに生成・終了するスレッド）は http_requests にまとめる
+    cpu_total = (process_end - process_start) / CLOCK_TICKS / elapsed * 100
+    cpu_threads = {}
+    for tid, name in thread_names.items():
+        if tid in threads_end:
+            cpu_threads[name] = (threads_end[tid] - threads_start.get(tid, 0)) / CLOCK_TICKS / elapsed * 100
+    cpu_threads['http_requests'] = max(0.0, cpu_total - sum(cpu_threads.values()))
+
+    return {
+        "scenario": {"rate_hz": rate, "baud": baud, "clients": clients, "engine": engine, "duration_s": round(elapsed, 3)},
+        "ports": ports,
+        "epochs": epochs | {"solutions_streamed": len(watcher.latencies)},
+        "heading_latency_ms": {k: v * 1000 if v is not None else None for k, v in percentiles(watcher.latencies).items()},
+        "http": http_result,
+        "cpu_percent": {
+            "total": cpu_total,
+            "threads": {k: round(v, 2) for k, v in sorted(cpu_threads.items(), key=lambda item: -item[1])},
+        },
+        "memory": memory,
+    }
+
+
+def summary_line(result):
+    s, lat = result['scenario'], result['heading_latency_ms']
+    dropped = sum(p['dropped_sentences'] for p in result['ports'].values())
+    rate = sum(p['sentences_per_sec'] for p in result['ports'].values())
+    http_rps = f"{result['http']['requests_per_sec']:>8.0f}" if result['http'] else f"{'-':>8}"
+    p50 = f"{lat['p50']:>7.2f}" if lat['p50'] is not None else f"{'-':>7}"
+    p99 = f"{lat['p99']:>7.2f}" if lat['p99'] is not None else f"{'-':>7}"
+    return (f"{s['engine']:<7} {s['rate_hz']:>5}Hz {s['baud']:>7}bps {s['clients']:>4}cl | 受信 {rate:>7.1f}文/秒 欠落 {dropped:>5} | "
+            f"遅延 p50 {p50}ms p99 {p99}ms | API {http_rps}req/秒 | CPU {result['cpu_percent']['total']:>5.1f}% "
+            f"RSS {result['memory']['rss_mb']:.1f}MB")
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=REPO_DIR, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="仮想シリアルポートを使った取得〜API配信の負荷試験")
+    parser.add_argument('--rates', default='1,10,50', help="受信機の出力レート（Hz、カンマ区切り）")
+    parser.add_argument('--bauds', default='9600,115200', help="ボーレート（カンマ区切り、4800〜921600）")
+    parser.add_argument('--clients', default='0,16', help="/api/position の同時クライアント数（カンマ区切り）")
+    parser.add_argument('--engines', default='threads', help="取得エンジン（threads / asyncio、カンマ区切り）")
+    parser.add_argument('--duration', type=float, default=10.0, help="1シナリオの計測時間（秒）")
+    parser.add_argument('--warmup', type=float, default=2.0, help="計測前の慣らし時間（秒）")
+    parser.add_argument('--output', help="結果JSONの出力先（省略時は標準出力）")
+    args = parser.parse_args()
+
+    def parse_list(text, kind):
+        return [kind(v) for v in text.split(',') if v.strip()]
+
+    results = []
+    with tempfile.TemporaryDirectory() as workdir:
+        for engine, rate, baud, clients in itertools.product(
+            parse_list(args.engines, str.strip), parse_list(args.rates, float), parse_list(args.bauds, int),
+            parse_list(args.clients, int)
+        ):
+            result = run_scenario(rate, baud, clients, engine, args.duration, args.warmup, workdir)
+            print(summary_line(result), file=sys.stderr)
+            results.append(result)
+
+    report = {
+        "meta": {
+            "revision": git_revision(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "timestamp": time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        },
+        "results": results,
+    }
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,50 @@
+import threading
+
+# --- ライブ配信（Server-Sent Events） ---
+# 新しい解が出るたびに1回だけシリアライズしたペイロードを全クライアントへ配信する。
+# クライアントごとのキューは持たず、常に最新フレームだけを参照するため、
+# 遅いクライアントは途中のフレームを読み飛ばし、メモリ使用量は接続数に比例して増えない。
+
+
+class Broadcaster:
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._version = 0
+        self._frame = None
+        self._listeners = []
+        self.clients = 0
+
+    def add_listener(self, callback):
+        # callback(frame): 新しいフレームごとに呼ばれる（別のイベントループへの転送用）
+        self._listeners.append(callback)
+
+    def publish(self, payload: bytes):
+        # payload: シリアライズ済みのJSON（bytes）
+        with self._cond:
+            self._version += 1
+            self._frame = frame = b'id: %d\ndata: %s\n\n' % (self._version, payload)
+            self._cond.notify_all()
+        for callback in self._listeners:
+            callback(frame)
+
+    def wait(self, last_version, timeout=None):
+        # last_version より新しいフレームを待つ。タイムアウト時は (last_version, None)
+        with self._cond:
+            if self._version == last_version:
+                self._cond.wait(timeout)
+            if self._version == last_version:
+                return last_version, None
+            return self._version, self._frame
+
+    def stream(self, heartbeat=15.0):
+        # SSEレスポンス用のジェネレーター。無通信時はコメント行を送り、切断を検出する
+        with self._cond:
+            self.clients += 1
+        try:
+            version = 0
+            while True:
+                version, frame = self.wait(version, heartbeat)
+                yield frame if frame is not None else b': keepalive\n\n'
+        finally:
+            with self._cond:
+                self.clients -= 1
@@ -0,0 +1,77 @@
+import threading
+import time
+from collections import OrderedDict, deque
+
+# --- エポック照合 ---
+# 基準局・移動局のGGAをUTC時刻で対にし、両方が揃った時点で計算スレッドへ通知する。
+# 固定間隔のポーリングをやめ、異なるエポック同士の組み合わせを防ぐ。
+
+
+def utc_key(utc_seconds):
+    # UTC秒（0時からの経過秒）をミリ秒単位の整数キーに丸める
+    return int(round(utc_seconds * 1000))
+
+
+class EpochPair:
+    __slots__ = ('utc', 'fixes', 'skew', 'completed_at')
+
+    def __init__(self, utc, fixes, skew, completed_at):
+        self.utc = utc                    # エポックのUTC秒
+        self.fixes = fixes                # {受信機キー: 測位データ}
+        self.skew = skew                  # 各受信機の到着時刻の差（秒）
+        self.completed_at = completed_at  # 全受信機が揃った時刻（time.monotonic）
+
+
+class EpochMatcher:
+    def __init__(self, keys=('base', 'rover'), max_pending=16, max_ready=8):
+        self.keys = tuple(keys)
+        self.max_pending = max_pending
+        self._cond = threading.Condition()
+        self._pending = OrderedDict()  # utc_key -> {受信機キー: (測位データ, 到着時刻)}
+        self._ready = deque()
+        self._max_ready = max_ready
+        # 統計
+        self.matched = 0
+        self.unmatched = 0  # 相手が揃わずに破棄されたエポック数
+        self.dropped = 0    # 計算が追いつかず破棄されたペア数
+
+    def submit(self, key, utc_seconds, fix):
+        arrived = time.monotonic()
+        k = utc_key(utc_seconds)
+        with self._cond:
+            halves = self._pending.get(k)
+            if halves is None:
+                halves = self._pending[k] = {}
+                while len(self._pending) > self.max_pending:
+                    self._pending.popitem(last=False)
+                    self.unmatched += 1
+            halves[key] = (fix, arrived)
+            if len(halves) < len(self.keys):
+                return
+            del self._pending[k]
+            # 受信機は時刻順に出力するので、これより古い未完成エポックはもう揃わない
+            for old in [p for p in self._pending if p < k]:
+                del self._pending[old]
+                self.unmatched += 1
+            times = [t for _, t in halves.values()]
+            pair = EpochPair(
+                utc_seconds,
+                {name: f for name, (f, _) in halves.items()},
+                max(times) - min(times),
+                arrived,
+            )
+            if len(self._ready) >= self._max_ready:
+                self._ready.popleft()
+                self.dropped += 1
+            self._ready.append(pair)
+            self.matched += 1
+            self._cond.notify_all()
+
+    def wait_pair(self, timeout=None):
+        # 揃ったペアが届くまで待機する。タイムアウト時はNoneを返す
+        with self._cond:
+            if not self._ready:
+                self._cond.wait(timeout)
+            if not self._ready:
+                return None
+            return self._ready.popleft()
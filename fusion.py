@@ -0,0 +1,77 @@
+import math
+import threading
+
+# --- IMU/GPSヘディング融合（カルマンフィルター） ---
+# 状態: [ヘディング(度), ジャイロZ軸バイアス(度/秒)]
+# IMUサンプルごとに実測のdtで積分（予測）し、GPSヘディングが届いたら補正する。
+# これによりGPSエポックの間もIMUレートで滑らかなヘディングが得られる。
+
+MIN_MEASUREMENT_STD = 0.01  # GPSヘディングの標準偏差の下限（度）。0だと予測なしの連続補正で分散が0になり発散する
+
+
+def wrap_180(angle):
+    # 角度差を -180〜180 度に正規化
+    return (angle + 180.0) % 360.0 - 180.0
+
+
+class HeadingFusion:
+    def __init__(self, gyro_noise=0.1, bias_drift=0.01, max_dt=1.0):
+        # gyro_noise: ジャイロ角速度ノイズ（度/秒）
+        # bias_drift: バイアスのランダムウォーク（度/秒/√秒）
+        # max_dt: これより長いIMUの欠測は積分しない（秒）
+        self.gyro_noise = gyro_noise
+        self.bias_drift = bias_drift
+        self.max_dt = max_dt
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.initialized = False
+            self.heading = 0.0
+            self.bias = 0.0
+            self._p = [[1e4, 0.0], [0.0, 1.0]]
+            self._last_t = None
+
+    def predict(self, gyro_z, t):
+        # gyro_z: Z軸角速度（度/秒）, t: サンプル時刻（time.monotonic）
+        with self._lock:
+            last_t, self._last_t = self._last_t, t
+            if not self.initialized or last_t is None:
+                return self.heading
+            dt = t - last_t
+            if dt <= 0.0 or dt > self.max_dt:
+                return self.heading
+            self.heading = (self.heading + (gyro_z - self.bias) * dt) % 360.0
+            p = self._p
+            q_h = self.gyro_noise**2 * dt
+            q_b = self.bias_drift**2 * dt
+            p01 = p[0][1] - dt * p[1][1]
+            p[0][0] = p[0][0] - 2 * dt * p[0][1] + dt * dt * p[1][1] + q_h
+            p[0][1] = p[1][0] = p01
+            p[1][1] += q_b
+            return self.heading
+
+    def correct(self, gps_heading, std):
+        # gps_heading: GPSヘディング（度）, std: その標準偏差（度）
+        with self._lock:
+            if not self.initialized:
+                self.heading = gps_heading % 360.0
+                self.initialized = True
+                return self.heading
+            p = self._p
+            innovation = wrap_180(gps_heading - self.heading)
+            std = max(std, MIN_MEASUREMENT_STD)
+            s = p[0][0] + std * std
+            k0, k1 = p[0][0] / s, p[1][0] / s
+            self.heading = (self.heading + k0 * innovation) % 360.0
+            self.bias += k1 * innovation
+            p00, p01, p11 = p[0][0], p[0][1], p[1][1]
+            p[0][0] = (1 - k0) * p00
+            p[0][1] = p[1][0] = (1 - k0) * p01
+            p[1][1] = p11 - k1 * p01
+            return self.heading
+
+    def heading_std(self):
+        with self._lock:
+            return math.sqrt(max(self._p[0][0], 0.0))
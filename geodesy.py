@@ -0,0 +1,84 @@
+import math
+
+# NumPyはバッチ計算（オフライン解析）でのみ使用する
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# --- 測地計算 ---
+# 基準局→移動局の距離・方位角・基線長誤差を求める。
+# スカラー版はリアルタイム計算用、*_batch 版は NumPy 配列を一括処理するオフライン解析用。
+# enu 系は基準局を原点とした局所平面近似で、0.7m 程度の短基線では球面計算と実質同じ結果になる。
+
+EARTH_RADIUS_M = 6371000  # 地球の平均半径（メートル）
+WGS84_A = 6378137.0  # 長半径
+WGS84_E2 = 6.69437999014e-3  # 第一離心率の2乗
+
+
+def _require_numpy():
+    if np is None:
+        raise ImportError("バッチ計算には numpy が必要です（pip install numpy）")
+
+
+# --- 球面（Haversine）---
+def distance_bearing(lat1, lon1, lat2, lon2):
+    # 戻り値: (距離[m], 方位角[度, 0〜360])
+    phi1, lambda1 = math.radians(lat1), math.radians(lon1)
+    phi2, lambda2 = math.radians(lat2), math.radians(lon2)
+    d_phi, d_lambda = phi2 - phi1, lambda2 - lambda1
+    a = math.sin(d_phi / 2)**2 + math.cos(phi1) * math.cos(phi2) * math.sin(d_lambda / 2)**2
+    c = 2 * math.atan2(math.sqrt(a), math.sqrt(1 - a))
+    y = math.sin(d_lambda) * math.cos(phi2)
+    x = math.cos(phi1) * math.sin(phi2) - math.sin(phi1) * math.cos(phi2) * math.cos(d_lambda)
+    return EARTH_RADIUS_M * c, (math.degrees(math.atan2(y, x)) + 360) % 360
+
+
+def baseline(lat1, lon1, lat2, lon2, baseline_length):
+    # 戻り値: (距離[m], 方位角[度], 基線長誤差[m])
+    distance, bearing = distance_bearing(lat1, lon1, lat2, lon2)
+    return distance, bearing, abs(distance - baseline_length)
+
+
+def baseline_batch(lat1, lon1, lat2, lon2, baseline_length):
+    # 引数は同じ長さの配列（度）。戻り値: (距離, 方位角, 基線長誤差) の配列
+    _require_numpy()
+    phi1, lambda1 = np.radians(lat1), np.radians(lon1)
+    phi2, lambda2 = np.radians(lat2), np.radians(lon2)
+    d_phi, d_lambda = phi2 - phi1, lambda2 - lambda1
+    cos_phi1, cos_phi2 = np.cos(phi1), np.cos(phi2)
+    a = np.sin(d_phi / 2)**2 + cos_phi1 * cos_phi2 * np.sin(d_lambda / 2)**2
+    distance = EARTH_RADIUS_M * 2 * np.arctan2(np.sqrt(a), np.sqrt(1 - a))
+    y = np.sin(d_lambda) * cos_phi2
+    x = cos_phi1 * np.sin(phi2) - np.sin(phi1) * cos_phi2 * np.cos(d_lambda)
+    bearing = np.degrees(np.arctan2(y, x)) % 360
+    return distance, bearing, np.abs(distance - baseline_length)
+
+
+# --- 局所平面（ENU）近似 ---
+def enu_offset(lat1, lon1, lat2, lon2):
+    # 基準局から見た移動局の (東[m], 北[m])。WGS84楕円体の子午線・卯酉線曲率半径を使用
+    phi = math.radians(lat1)
+    w2 = 1 - WGS84_E2 * math.sin(phi)**2
+    n = WGS84_A / math.sqrt(w2)
+    m = WGS84_A * (1 - WGS84_E2) / (w2 * math.sqrt(w2))
+    return math.radians(lon2 - lon1) * n * math.cos(phi), math.radians(lat2 - lat1) * m
+
+
+def baseline_enu(lat1, lon1, lat2, lon2, baseline_length):
+    # 戻り値: (距離[m], 方位角[度], 基線長誤差[m])
+    east, north = enu_offset(lat1, lon1, lat2, lon2)
+    distance = math.hypot(east, north)
+    return distance, math.degrees(math.atan2(east, north)) % 360, abs(distance - baseline_length)
+
+
+def baseline_enu_batch(lat1, lon1, lat2, lon2, baseline_length):
+    _require_numpy()
+    phi = np.radians(lat1)
+    w2 = 1 - WGS84_E2 * np.sin(phi)**2
+    n = WGS84_A / np.sqrt(w2)
+    m = WGS84_A * (1 - WGS84_E2) / (w2 * np.sqrt(w2))
+    east = np.radians(np.subtract(lon2, lon1)) * n * np.cos(phi)
+    north = np.radians(np.subtract(lat2, lat1)) * m
+    distance = np.hypot(east, north)
+    return distance, np.degrees(np.arctan2(east, north)) % 360, np.abs(distance - baseline_length)
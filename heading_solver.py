@@ -0,0 +1,43 @@
+import math
+from collections import namedtuple
+
+import geodesy
+from smoothing import HeadingWindow
+
+# --- 1エポック分の基線の解（ライブ処理と記録ログの再処理で共通） ---
+# HDOP・測位の有無による判定、距離・方位角・基線長誤差、高度差による傾き、ウィンドウ平滑化を行う。
+
+REJECT_NO_FIX = 'no_fix'
+REJECT_HDOP = 'hdop'
+REJECT_RESIDUAL = 'residual'
+REJECT_REASONS = (REJECT_NO_FIX, REJECT_HDOP, REJECT_RESIDUAL)
+
+# smoothed / sigma はウィンドウ平滑化後のヘディングとσ（度）、hdop は両端の大きい方
+HeadingResult = namedtuple('HeadingResult', 'heading smoothed sigma tilt distance error hdop')
+
+
+class HeadingSolver:
+    def __init__(self, baseline_length, hdop_threshold, window_size=10, reject_error=0.2, residual_scale=0.05):
+        self.baseline_length = baseline_length
+        self.hdop_threshold = hdop_threshold
+        self.window = HeadingWindow(window_size, reject_error, residual_scale)
+        self.last_error = None  # 直前に計算した基線長誤差（除外時のログ用）
+
+    def solve(self, utc, base, rover):
+        # base, rover: GgaFix。戻り値: (除外理由, None) または (None, HeadingResult)
+        if base.lat == 0.0 or base.lon == 0.0 or rover.lat == 0.0 or rover.lon == 0.0:
+            return REJECT_NO_FIX, None
+        hdop = max(base.hdop, rover.hdop)
+        if hdop > self.hdop_threshold:
+            return REJECT_HDOP, None
+
+        # Haversine公式で距離・方位角・基線長誤差を計算し、高度差から基線方向の傾きを求める
+        distance, heading, error = geodesy.baseline(base.lat, base.lon, rover.lat, rover.lon, self.baseline_length)
+        tilt = math.degrees(math.atan2(rover.altitude - base.altitude, distance))
+        self.last_error = error
+
+        # 直近のエポックをHDOPと基線長誤差で重み付けして平滑化する。基線長誤差が上限を超えたエポックは除外
+        if not self.window.add(heading, hdop, error, utc):
+            return REJECT_RESIDUAL, None
+        smoothed, sigma = self.window.estimate()
+        return None, HeadingResult(heading, smoothed, sigma, tilt, distance, error, hdop)
@@ -0,0 +1,110 @@
+import os
+import threading
+import time
+
+import numpy as np
+
+# --- 解の時系列履歴（固定長リングバッファ） ---
+# 計算された解をタイムスタンプ付きでNumPyの構造化配列に上書き保存する。
+# 容量は固定なので、稼働時間が延びてもメモリ使用量は一定。
+# path を指定するとファイル（tmpfs）上にmemmapで置き、acquisition プロセスが書き込んだ履歴を
+# web ワーカーがロックなしで読み取れる。
+# 時刻は書き込みロック内で time.monotonic() を読んで付けるので、行は常に時刻順に並ぶ
+# （NTPによる時計の修正やスレッド間の競合で順序が崩れると、二分探索による区間分けが狂うため）。
+# 単調時計はシステム全体で共通なので、別プロセスからも同じ基準で読める。壁時計への変換は出力時に行う。
+
+FIELDS = ('heading', 'heading_gps', 'error', 'distance', 'hdop_base', 'hdop_rover', 'gyro_z')
+CIRCULAR_FIELDS = frozenset(('heading', 'heading_gps'))  # 平均は円周統計で求める
+ROW = np.dtype([('t', '<f8')] + [(name, '<f4') for name in FIELDS])  # t: time.monotonic()
+HEADER_SIZE = 64  # 先頭: int64 x 2（書き込み総数, 容量）
+
+
+class SolutionHistory:
+    def __init__(self, capacity, path=None):
+        self._lock = threading.Lock()  # 書き込み同士の直列化のみ（読み取りはロック不要）
+        if path is None:
+            self._header = np.zeros(2, dtype='<i8')
+            self._rows = np.zeros(capacity, dtype=ROW)
+        else:
+            size = HEADER_SIZE + capacity * ROW.itemsize
+            fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+            try:
+                os.ftruncate(fd, size)
+            finally:
+                os.close(fd)
+            self._header = np.memmap(path, dtype='<i8', mode='r+', shape=(2,))
+            self._rows = np.memmap(path, dtype=ROW, mode='r+', offset=HEADER_SIZE, shape=(capacity,))
+            self._header[0] = 0
+        self._header[1] = capacity
+        self.capacity = capacity
+
+    @classmethod
+    def open_reader(cls, path):
+        # 他プロセスが書き込む履歴ファイルを読み取り専用で開く。
+        # 未作成、または作成直後（サイズ・容量の書き込み前）なら None を返すので、次の呼び出しで開き直す
+        try:
+            size = os.path.getsize(path)
+        except FileNotFoundError:
+            return None
+        if size < HEADER_SIZE:
+            return None
+        header = np.memmap(path, dtype='<i8', mode='r', shape=(2,))
+        capacity = int(header[1])
+        if capacity <= 0 or size < HEADER_SIZE + capacity * ROW.itemsize:
+            return None
+        history = cls.__new__(cls)
+        history._lock = None
+        history._header = header
+        history.capacity = capacity
+        history._rows = np.memmap(path, dtype=ROW, mode='r', offset=HEADER_SIZE, shape=(capacity,))
+        return history
+
+    def append(self, values):
+        # values: FIELDS の順の値
+        with self._lock:
+            total = int(self._header[0])
+            self._rows[total % self.capacity] = (time.monotonic(), *values)
+            self._header[0] = total + 1  # 行を書き終えてから公開
+
+    def _ordered(self):
+        # 古い順に並べた全行のコピー
+        total = int(self._header[0])
+        if total <= self.capacity:
+            return np.array(self._rows[:total])
+        # 書き込み中の最古行と重なる可能性がある先頭1行は除く
+        start = total % self.capacity
+        return np.concatenate((self._rows[start + 1:], self._rows[:start]))
+
+    def query(self, window, buckets, fields=FIELDS):
+        # 直近 window 秒を buckets 個の区間に分け、区間ごとの最小・最大・平均を返す（空の区間は省く）
+        # 戻り値の t は区間の開始時刻（UNIX時刻）
+        end = time.monotonic()
+        start = end - window
+        wall_offset = time.time() - end
+        rows = self._ordered()
+        t = rows['t']
+        lo, hi = np.searchsorted(t, (start, end))
+        rows, t = rows[lo:hi], t[lo:hi]
+        edges = np.linspace(start, end, buckets + 1)[:-1]
+        first = np.searchsorted(t, edges)
+        counts = np.diff(np.append(first, len(t)))
+        nonempty = counts > 0
+        first, counts = first[nonempty], counts[nonempty]
+        result = {'t': edges[nonempty] + wall_offset, 'count': counts}
+        if not len(first):
+            for name in fields:
+                result[name] = {'min': np.empty(0), 'max': np.empty(0), 'mean': np.empty(0)}
+            return result
+        for name in fields:
+            col = rows[name].astype(np.float64)
+            if name in CIRCULAR_FIELDS:
+                rad = np.radians(col)
+                mean = np.degrees(np.arctan2(np.add.reduceat(np.sin(rad), first), np.add.reduceat(np.cos(rad), first))) % 360
+            else:
+                mean = np.add.reduceat(col, first) / counts
+            result[name] = {
+                'min': np.minimum.reduceat(col, first),
+                'max': np.maximum.reduceat(col, first),
+                'mean': mean,
+            }
+        return result
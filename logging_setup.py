@@ -0,0 +1,88 @@
+import atexit
+import logging
+import logging.handlers
+import queue
+import threading
+import time
+
+# --- 非同期・ローテーション・レート制限付きログ ---
+# ログ呼び出し側はキューへ積むだけで、ファイル書き込みは専用スレッド（QueueListener）が行う。
+# SDカードへの書き込みが詰まっても、センサー処理のスレッドは待たされない。
+# 同じ呼び出し箇所からのメッセージは一定間隔ごとに数件までに制限し、抑制した件数を次の出力に付記する。
+# ローテーションはファイル名の変更を伴うため、ファイルを回すのは1プロセスだけにする。
+# 他のプロセス（Webワーカー）は標準エラー出力か、外部（logrotate等）でローテーションする別ファイルへ書く。
+
+
+class RateLimitFilter(logging.Filter):
+    def __init__(self, interval=10.0, burst=3):
+        super().__init__()
+        self.interval = interval
+        self.burst = burst
+        self._lock = threading.Lock()
+        self._state = {}  # キー -> [区間開始時刻, 区間内の出力数, 抑制数]
+
+    def filter(self, record):
+        # キーは extra={'rate_key': ...} で明示できる。省略時は呼び出し箇所
+        key = getattr(record, 'rate_key', None) or (record.pathname, record.lineno)
+        now = time.monotonic()
+        with self._lock:
+            state = self._state.get(key)
+            if state is None or now - state[0] >= self.interval:
+                suppressed = state[2] if state is not None else 0
+                self._state[key] = [now, 1, 0]
+            elif state[1] < self.burst:
+                state[1] += 1
+                suppressed = 0
+            else:
+                state[2] += 1
+                return False
+        if suppressed:
+            record.msg = f"{record.getMessage()}（類似メッセージ {suppressed} 件を抑制しました）"
+            record.args = None
+        return True
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    # キューが満杯なら待たずに破棄する（書き込みスレッドが詰まっても呼び出し側をブロックしない）
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+def configure_logging(path='app.log', max_bytes=5 * 1024 * 1024, backup_count=5,
+                      rate_limit_interval=10.0, rate_limit_burst=3, level=logging.INFO, queue_size=10000,
+                      rotate=True):
+    # path: ログファイル（空なら標準エラー出力のみ）
+    # rotate: True ならこのプロセスがサイズでローテーションする。False なら外部のローテーション後に開き直すだけ
+    formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
+    handlers = []
+    if path:
+        if rotate:
+            file_handler = logging.handlers.RotatingFileHandler(
+                path, maxBytes=max_bytes, backupCount=backup_count, encoding='utf-8')
+        else:
+            file_handler = logging.handlers.WatchedFileHandler(path, encoding='utf-8')
+        file_handler.setFormatter(formatter)
+        handlers.append(file_handler)
+    stream_handler = logging.StreamHandler()
+    stream_handler.setFormatter(formatter)
+    handlers.append(stream_handler)
+
+    queue_handler = DroppingQueueHandler(queue.Queue(maxsize=queue_size))
+    queue_handler.addFilter(RateLimitFilter(rate_limit_interval, rate_limit_burst))
+    listener = logging.handlers.QueueListener(queue_handler.queue, *handlers)
+    listener.start()
+    atexit.register(listener.stop)
+
+    root = logging.getLogger()
+    root.setLevel(level)
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    return queue_handler
@@ -0,0 +1,135 @@
+import threading
+from bisect import bisect_left
+
+# --- 軽量メトリクス（Prometheusテキスト形式） ---
+# カウンターとヒストグラムは生成時に領域を確保し、更新は加算のみ（ロックなし・追加の割り当てなし）。
+# ヒストグラムはHDR風の固定バケット（指数間隔）で、20Hzの常時計測でも負荷は無視できる。
+# 各メトリクスは原則として1つのスレッドだけが更新する前提。
+# 複数スレッドから更新するヒストグラム（Webリクエストの処理時間など）は threadsafe=True でロック付きにする。
+
+
+def exponential_buckets(start, factor, count):
+    return tuple(start * factor**i for i in range(count))
+
+
+LATENCY_BUCKETS = exponential_buckets(50e-6, 2, 16)  # 50µs 〜 約1.6秒
+LONG_POLL_BUCKETS = exponential_buckets(1e-3, 2, 17)  # 1ms 〜 約65秒（ロングポーリングの待ち時間込み）
+INTERVAL_BUCKETS = exponential_buckets(1e-3, 1.5, 16)  # 1ms 〜 約0.44秒（サンプル間隔のジッター用）
+
+
+def _format_labels(labels, extra=None):
+    items = list(labels.items())
+    if extra:
+        items.append(extra)
+    if not items:
+        return ''
+    return '{' + ','.join(f'{k}="{v}"' for k, v in items) + '}'
+
+
+def _format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    __slots__ = ('name', 'help', 'labels', 'value')
+    kind = 'counter'
+
+    def __init__(self, name, help, labels):
+        self.name, self.help, self.labels = name, help, labels
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def samples(self):
+        yield self.name + _format_labels(self.labels), self.value
+
+
+class Histogram:
+    __slots__ = ('name', 'help', 'labels', 'bounds', 'counts', 'sum', 'count')
+    kind = 'histogram'
+
+    def __init__(self, name, help, labels, bounds):
+        self.name, self.help, self.labels = name, help, labels
+        self.bounds = tuple(bounds)
+        self.counts = [0] * (len(self.bounds) + 1)  # 最後は +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def _values(self):
+        return self.counts, self.sum, self.count
+
+    def samples(self):
+        counts, total, count = self._values()
+        cumulative = 0
+        for bound, n in zip(self.bounds, counts):
+            cumulative += n
+            yield self.name + '_bucket' + _format_labels(self.labels, ('le', repr(bound))), cumulative
+        yield self.name + '_bucket' + _format_labels(self.labels, ('le', '+Inf')), cumulative + counts[-1]
+        yield self.name + '_sum' + _format_labels(self.labels), total
+        yield self.name + '_count' + _format_labels(self.labels), count
+
+
+class LockedHistogram(Histogram):
+    # 複数スレッドから observe されるヒストグラム。バケット・合計・件数を1つのロックで揃えて更新・出力する
+    __slots__ = ('_lock',)
+
+    def __init__(self, name, help, labels, bounds):
+        super().__init__(name, help, labels, bounds)
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        i = bisect_left(self.bounds, value)
+        with self._lock:
+            self.counts[i] += 1
+            self.sum += value
+            self.count += 1
+
+    def _values(self):
+        with self._lock:
+            return list(self.counts), self.sum, self.count
+
+
+class CallbackMetric:
+    # 出力時に関数を呼んで値を取得する（既存の統計カウンターやゲージの公開用）
+    __slots__ = ('name', 'help', 'labels', 'kind', 'func')
+
+    def __init__(self, name, help, labels, kind, func):
+        self.name, self.help, self.labels, self.kind, self.func = name, help, labels, kind, func
+
+    def samples(self):
+        yield self.name + _format_labels(self.labels), self.func()
+
+
+class Registry:
+    def __init__(self):
+        self._families = {}  # 名前 -> [メトリクス, ...]（登録順を保持）
+
+    def _register(self, metric):
+        self._families.setdefault(metric.name, []).append(metric)
+        return metric
+
+    def counter(self, name, help, **labels):
+        return self._register(Counter(name, help, labels))
+
+    def histogram(self, name, help, bounds=LATENCY_BUCKETS, threadsafe=False, **labels):
+        cls = LockedHistogram if threadsafe else Histogram
+        return self._register(cls(name, help, labels, bounds))
+
+    def callback(self, name, help, func, kind='gauge', **labels):
+        return self._register(CallbackMetric(name, help, labels, kind, func))
+
+    def render(self):
+        lines = []
+        for name, metrics in self._families.items():
+            lines.append(f'# HELP {name} {metrics[0].help}')
+            lines.append(f'# TYPE {name} {metrics[0].kind}')
+            for metric in metrics:
+                for sample, value in metric.samples():
+                    lines.append(f'{sample} {_format_value(value)}')
+        return '\n'.join(lines) + '\n'
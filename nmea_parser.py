@@ -0,0 +1,82 @@
+from collections import namedtuple
+
+# --- 高速NMEAデコーダー ---
+# チェックサム検証済みの文（bytes）を文字列に変換せず直接数値化する。
+# pynmea2 のオブジェクト生成やプロパティ経由の変換を経ないため、読み取りスレッドの負荷が小さい。
+# 対応: GGA / RMC / HDT（トーカーIDは問わない）。それ以外は None を返すので pynmea2 で処理する。
+
+GgaFix = namedtuple('GgaFix', 'utc lat lon quality num_sats hdop altitude')
+RmcFix = namedtuple('RmcFix', 'utc valid lat lon speed_knots course')
+HdtFix = namedtuple('HdtFix', 'heading')
+
+
+def _fields(sentence):
+    # b'$GPGGA,a,b,...*hh' -> [b'a', b'b', ...]（末尾のチェックサム部は除く）
+    star = sentence.rfind(b'*')
+    return sentence[7:star if star > 0 else len(sentence)].split(b',')
+
+
+def _utc(field):
+    # hhmmss.ss -> 0時からの経過秒
+    v = float(field)
+    hhmm = int(v) // 100
+    return (hhmm // 100) * 3600 + (hhmm % 100) * 60 + (v - hhmm * 100)
+
+
+def _coord(value, hemisphere, negative):
+    # ddmm.mmmm / dddmm.mmmm -> 10進度
+    v = float(value)
+    deg = int(v) // 100
+    result = deg + (v - deg * 100) / 60.0
+    return -result if hemisphere == negative else result
+
+
+def parse_gga(sentence):
+    f = _fields(sentence)
+    if len(f) < 9 or not f[1] or not f[3] or not f[7]:
+        return None  # 測位なし
+    return GgaFix(
+        _utc(f[0]) if f[0] else None,
+        _coord(f[1], f[2], b'S'),
+        _coord(f[3], f[4], b'W'),
+        int(f[5]) if f[5] else 0,
+        int(f[6]) if f[6] else 0,
+        float(f[7]),
+        float(f[8]) if f[8] else 0.0,
+    )
+
+
+def parse_rmc(sentence):
+    f = _fields(sentence)
+    if len(f) < 8 or not f[2] or not f[4]:
+        return None
+    return RmcFix(
+        _utc(f[0]) if f[0] else None,
+        f[1] == b'A',
+        _coord(f[2], f[3], b'S'),
+        _coord(f[4], f[5], b'W'),
+        float(f[6]) if f[6] else 0.0,
+        float(f[7]) if f[7] else None,
+    )
+
+
+def parse_hdt(sentence):
+    f = _fields(sentence)
+    if not f[0]:
+        return None
+    return HdtFix(float(f[0]))
+
+
+_PARSERS = {b'GGA': parse_gga, b'RMC': parse_rmc, b'HDT': parse_hdt}
+
+
+def parse(sentence):
+    # 対応する文種別ならデコード結果を返す（測位なし・非対応の文は None）
+    parser = _PARSERS.get(sentence[3:6])
+    if parser is None:
+        return None
+    return parser(sentence)
+
+
+def is_supported(sentence):
+    return sentence[3:6] in _PARSERS
@@ -0,0 +1,75 @@
+# --- NMEAフレーミング ---
+# シリアルから一括で読み取ったバイト列を再利用バッファに蓄積し、文単位に切り出す。
+# チェックサムは文字列デコード前にバイト列のまま検証し、必要な文だけを返す。
+
+MAX_SENTENCE_LENGTH = 256  # NMEA 0183 の規定は82文字。余裕を持たせた上限
+
+
+def nmea_checksum_ok(sentence):
+    # sentence: b'$GPGGA,...*hh'（改行なし）
+    star = len(sentence) - 3
+    if star < 1 or sentence[star] != 0x2A:  # '*'
+        return False
+    try:
+        expected = int(sentence[star + 1:], 16)
+    except ValueError:
+        return False
+    checksum = 0
+    for b in sentence[1:star]:
+        checksum ^= b
+    return checksum == expected
+
+
+class NmeaFramer:
+    def __init__(self, wanted=None, max_length=MAX_SENTENCE_LENGTH):
+        # wanted: 取り出す文種別の集合（例: {b'GPGGA', b'GNGGA'}）。Noneなら全て
+        self.wanted = frozenset(wanted) if wanted is not None else None
+        self.max_length = max_length
+        self._buf = bytearray()
+        # 統計
+        self.bytes_read = 0
+        self.sentences = 0          # 切り出した文の数
+        self.checksum_failures = 0
+        self.overruns = 0           # 欠落・長すぎる文の破棄（取りこぼしの兆候）
+
+    def feed(self, data):
+        # 受信バイト列を追加し、チェックサム検証済みの必要な文（bytes）のリストを返す
+        buf = self._buf
+        buf += data
+        self.bytes_read += len(data)
+        wanted = self.wanted
+        out = []
+        start = 0
+        while True:
+            nl = buf.find(b'\n', start)
+            if nl < 0:
+                break
+            dollar = buf.rfind(b'$', start, nl)
+            if dollar < 0:
+                start = nl + 1
+                continue
+            if dollar > start:
+                # '$' の前に途中で切れた文が残っている
+                self.overruns += 1
+            end = nl - 1 if buf[nl - 1] == 0x0D else nl  # '\r'
+            sentence = bytes(buf[dollar:end])
+            start = nl + 1
+            self.sentences += 1
+            if not nmea_checksum_ok(sentence):
+                self.checksum_failures += 1
+                continue
+            if wanted is None or sentence[1:6] in wanted:
+                out.append(sentence)
+        del buf[:start]
+        if len(buf) > self.max_length:
+            buf.clear()
+            self.overruns += 1
+        return out
+
+    def stats(self):
+        return {
+            "bytes_read": self.bytes_read,
+            "sentences": self.sentences,
+            "checksum_failures": self.checksum_failures,
+            "overruns": self.overruns,
+        }
@@ -0,0 +1,113 @@
+import json
+import math
+import struct
+import threading
+
+# --- /api/position の応答キャッシュとバイナリ形式 ---
+# 解のバージョンごとにJSON・バイナリを1回だけシリアライズして使い回す。
+# バイナリ形式は高頻度でポーリングする機械クライアント・低速な無線回線向けの固定長（68バイト）のレイアウト:
+#   <B  形式のバージョン（BIN_FORMAT_VERSION）
+#    B  フラグ（bit0: IMU使用中）
+#    xx
+#    Q  解のバージョン
+#    d  エポックのUTC秒（未確定なら NaN）
+#    d  緯度, d 経度
+#    f  ヘディング, f ヘディングのσ（未推定なら NaN）, f 基線距離, f 基線誤差,
+#    f  HDOP（基準局）, f HDOP（移動局）, f ジャイロZ
+#    B  測位品質（基準局）, B 測位品質（移動局）, B 衛星数（基準局）, B 衛星数（移動局）
+
+POSITION_BIN = struct.Struct('<BBxxQdddfffffffBBBB')
+BIN_FORMAT_VERSION = 1
+FLAG_IMU = 0x01
+
+
+def _nan(value):
+    return math.nan if value is None else value
+
+
+def _none(value):
+    return None if math.isnan(value) else value
+
+
+def encode_bin(payload):
+    # payload: position_payload の辞書
+    return POSITION_BIN.pack(
+        BIN_FORMAT_VERSION,
+        FLAG_IMU if payload['imu'] else 0,
+        payload['version'],
+        _nan(payload.get('utc')),
+        payload['lat'], payload['lon'],
+        payload['heading'], _nan(payload.get('heading_sigma')), payload['distance'], payload['error'],
+        payload['hdop_base'], payload['hdop_rover'], payload['imu_raw_gyro_z'],
+        payload['quality_base'] & 0xFF, payload['quality_rover'] & 0xFF,
+        min(payload['num_sats_base'], 255), min(payload['num_sats_rover'], 255),
+    )
+
+
+def decode_bin(data):
+    # encode_bin の逆変換（クライアント実装の参考用）
+    (fmt, flags, version, utc, lat, lon, heading, heading_sigma, distance, error, hdop_base, hdop_rover, gyro_z,
+     quality_base, quality_rover, num_sats_base, num_sats_rover) = POSITION_BIN.unpack(data)
+    if fmt != BIN_FORMAT_VERSION:
+        raise ValueError(f"未対応のバイナリ形式です: {fmt}")
+    return {
+        "version": version, "utc": _none(utc), "lat": lat, "lon": lon,
+        "heading": heading, "heading_sigma": _none(heading_sigma), "distance": distance, "error": error,
+        "imu": bool(flags & FLAG_IMU), "imu_raw_gyro_z": gyro_z, "hdop_base": hdop_base, "hdop_rover": hdop_rover,
+        "quality_base": quality_base, "quality_rover": quality_rover,
+        "num_sats_base": num_sats_base, "num_sats_rover": num_sats_rover,
+    }
+
+
+class CachedPosition:
+    __slots__ = ('version', '_payload', '_json', '_bin')
+
+    def __init__(self, version, payload=None, json_bytes=None):
+        self.version = version
+        self._payload = payload
+        self._json = json_bytes
+        self._bin = None
+
+    def payload(self):
+        if self._payload is None:
+            self._payload = json.loads(self._json)
+        return self._payload
+
+    def json(self):
+        if self._json is None:
+            self._json = json.dumps(self._payload).encode()
+        return self._json
+
+    def bin(self):
+        if self._bin is None:
+            self._bin = encode_bin(self.payload())
+        return self._bin
+
+
+class PositionCache:
+    # 最新バージョンの1件だけを保持する。読み取りは参照を見るだけでロックは不要
+    # （同時に作り直しが起きても結果は同じで、無駄な計算が1回増えるだけ）。put は待機中のロングポーリングを起こす
+    def __init__(self):
+        self._entry = None
+        self._cond = threading.Condition()
+
+    def put(self, version, payload=None, json_bytes=None):
+        entry = CachedPosition(version, payload, json_bytes)
+        with self._cond:
+            self._entry = entry
+            self._cond.notify_all()
+        return entry
+
+    def latest(self):
+        return self._entry
+
+    def lookup(self, version):
+        entry = self._entry
+        return entry if entry is not None and entry.version == version else None
+
+    def wait(self, version, timeout=None):
+        # version より新しい解が入るまで待つ。タイムアウト時は None
+        with self._cond:
+            if self._cond.wait_for(lambda: self._entry is not None and self._entry.version > version, timeout):
+                return self._entry
+        return None
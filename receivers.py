@@ -0,0 +1,142 @@
+import logging
+import os
+import selectors
+import time
+
+import serial
+
+from epoch_matcher import EpochMatcher
+from nmea_reader import NmeaFramer
+
+logger = logging.getLogger(__name__)
+
+# --- 受信機レジストリとシリアル入力の多重化 ---
+# 受信機（アンテナ）は config.ini の [Receivers]、基線は [Baselines] で任意の数を定義する。
+# 全受信機のシリアルポートを1つのスレッドで selectors により監視し、届いたバイト列を受信機ごとに処理する。
+# アンテナを増やしてもスレッドは増えない。基線ごとに独立したエポック照合器を持つ。
+
+
+class Receiver:
+    __slots__ = ('name', 'port', 'baudrate', 'framer', 'baselines', 'serial', 'next_retry')
+
+    def __init__(self, name, port, baudrate, wanted=None):
+        self.name = name
+        self.port = port
+        self.baudrate = baudrate
+        self.framer = NmeaFramer(wanted)
+        self.baselines = []    # この受信機を含む基線
+        self.serial = None     # 開いているポート（未接続なら None）
+        self.next_retry = 0.0  # 次に接続を試みる時刻（time.monotonic）
+
+
+class Baseline:
+    __slots__ = ('name', 'base', 'rover', 'length', 'matcher')
+
+    def __init__(self, name, base, rover, length):
+        self.name = name
+        self.base = base      # 基準側の受信機名
+        self.rover = rover    # 移動側の受信機名
+        self.length = length  # 基線長（メートル）
+        self.matcher = EpochMatcher((base, rover))
+
+
+def load_receivers(config, default_baudrate, wanted=None):
+    # [Receivers] 名前 = シリアルポート[, ボーレート]。セクションが空なら [GPS] BasePort / RoverPort を使う
+    entries = dict(config.items('Receivers')) if config.has_section('Receivers') else {}
+    if not entries:
+        entries = {
+            'base': config.get('GPS', 'BasePort', fallback='/dev/ttyUSB0'),
+            'rover': config.get('GPS', 'RoverPort', fallback='/dev/ttyUSB1'),
+        }
+    receivers = {}
+    for name, value in entries.items():
+        port, _, baudrate = (part.strip() for part in value.partition(','))
+        receivers[name] = Receiver(name, port, int(baudrate) if baudrate else default_baudrate, wanted)
+    return receivers
+
+
+def load_baselines(config, receivers, default_length):
+    # [Baselines] 名前 = 基準受信機, 移動受信機[, 基線長]。セクションが空なら base → rover の1本
+    entries = dict(config.items('Baselines')) if config.has_section('Baselines') else {}
+    if not entries:
+        entries = {'main': 'base, rover'}
+    baselines = []
+    for name, value in entries.items():
+        parts = [part.strip() for part in value.split(',')]
+        if len(parts) not in (2, 3):
+            raise ValueError(f"基線 {name} の指定が不正です（基準受信機, 移動受信機[, 基線長]）: {value}")
+        unknown = [p for p in parts[:2] if p not in receivers]
+        if unknown:
+            raise ValueError(f"基線 {name} に未定義の受信機が指定されています: {', '.join(unknown)}")
+        baseline = Baseline(name, parts[0], parts[1], float(parts[2]) if len(parts) == 3 else default_length)
+        receivers[baseline.base].baselines.append(baseline)
+        receivers[baseline.rover].baselines.append(baseline)
+        baselines.append(baseline)
+    return baselines
+
+
+class SerialMultiplexer:
+    # on_data(receiver, data) を受信のたびに呼ぶ。切断・未接続のポートは retry_interval 秒ごとに開き直す
+    def __init__(self, receivers, on_data, retry_interval=5.0):
+        self.receivers = list(receivers)
+        self.on_data = on_data
+        self.retry_interval = retry_interval
+        self._selector = selectors.DefaultSelector()
+
+    def _open(self, receiver, now):
+        if not os.path.exists(receiver.port):
+            logger.error(f"GPSポート {receiver.port} が見つかりません。{self.retry_interval}秒後に再試行します。")
+            receiver.next_retry = now + self.retry_interval
+            return
+        try:
+            receiver.serial = serial.Serial(receiver.port, receiver.baudrate, timeout=0)
+        except serial.SerialException as e:
+            logger.error(f"GPSポート {receiver.port} を開けません: {e}。{self.retry_interval}秒後に再試行します。")
+            receiver.next_retry = now + self.retry_interval
+            return
+        self._selector.register(receiver.serial.fileno(), selectors.EVENT_READ, receiver)
+        logger.info(f"GPSポート {receiver.port}（{receiver.name}）が正常に開かれました。")
+
+    def _close(self, receiver, now):
+        self._selector.unregister(receiver.serial.fileno())
+        try:
+            receiver.serial.close()
+        except OSError:
+            pass  # 抜かれたデバイスは close でも失敗することがある
+        receiver.serial = None
+        receiver.next_retry = now + self.retry_interval
+
+    def run(self):
+        # 1つのスレッドで全受信機を扱うので、どの例外でもループを終わらせない
+        while True:
+            try:
+                self._poll()
+            except Exception as e:
+                logger.error(f"シリアル入力の監視で予期せぬエラー: {e}")
+                time.sleep(self.retry_interval)
+
+    def _poll(self):
+        now = time.monotonic()
+        for receiver in self.receivers:
+            if receiver.serial is None and now >= receiver.next_retry:
+                self._open(receiver, now)
+        waiting = [r.next_retry for r in self.receivers if r.serial is None]
+        timeout = max(0.0, min(waiting) - now) if waiting else None
+        if not self._selector.get_map():
+            time.sleep(timeout)  # 開いているポートがない
+            return
+        for key, _ in self._selector.select(timeout):
+            receiver = key.data
+            try:
+                # 受信済みのバイトをまとめて読み取る
+                data = receiver.serial.read(receiver.serial.in_waiting or 1)
+            except (serial.SerialException, OSError) as e:
+                # USBの抜去では in_waiting（ioctl）が OSError(EIO) を送出する
+                logger.error(f"GPSポート {receiver.port} でシリアル通信エラー: {e}。再接続を試みます。")
+                self._close(receiver, time.monotonic())
+                continue
+            if data:
+                try:
+                    self.on_data(receiver, data)
+                except Exception as e:
+                    logger.error(f"GPSポート {receiver.port} で予期せぬエラー: {e}。")
@@ -0,0 +1,174 @@
+import atexit
+import queue
+import struct
+import threading
+import time
+
+# --- 記録と再生 ---
+# 基準局・移動局の生NMEAバイト列とIMUサンプルを単調増加タイムスタンプ付きで追記型ファイルに記録し、
+# 実機と同じ読み取りコードへ 1倍速 / N倍速 / 最速 で再生する。
+#
+# ファイル形式: 先頭にMAGIC、以降はレコードの連続
+#   レコード = ヘッダ struct('<dBH')（time.monotonic秒, チャンネルID, ペイロード長） + ペイロード
+#   チャンネルID 255 はチャンネル宣言（ペイロード = ID 1バイト + チャンネル名）
+#   チャンネルID 254 はセッション開始（ペイロード = struct('<d') 開始時のUNIX時刻）。
+#     同じファイルへ追記した別の起動の記録はタイムスタンプの基準が異なるため、再生はここで時刻の基準を取り直す
+#   IMUチャンネルのペイロードは struct('<3d')（ジャイロ x, y, z）
+
+MAGIC = b'GPSREC1\n'
+RECORD_HEADER = struct.Struct('<dBH')
+IMU_SAMPLE = struct.Struct('<3d')
+DECLARE_CHANNEL = 255
+SESSION_CHANNEL = 254
+SESSION_START = struct.Struct('<d')
+IMU_CHANNEL_NAME = 'imu'
+
+
+class Recorder:
+    def __init__(self, path, flush_interval=1.0):
+        self._file = open(path, 'ab')
+        if self._file.tell() == 0:
+            self._file.write(MAGIC)
+        payload = SESSION_START.pack(time.time())
+        self._file.write(RECORD_HEADER.pack(time.monotonic(), SESSION_CHANNEL, len(payload)) + payload)
+        self._lock = threading.Lock()
+        self._channels = {}
+        self._flush_interval = flush_interval
+        self._last_flush = time.monotonic()
+        atexit.register(self.close)  # 終了時にバッファ内の未書き込み分（最大 flush_interval 秒）を書き出す
+
+    def _channel_id(self, name):
+        # 呼び出し元でロック取得済み
+        cid = self._channels.get(name)
+        if cid is None:
+            cid = self._channels[name] = len(self._channels)
+            payload = bytes([cid]) + name.encode('utf-8')
+            self._file.write(RECORD_HEADER.pack(time.monotonic(), DECLARE_CHANNEL, len(payload)) + payload)
+        return cid
+
+    def write(self, name, data):
+        now = time.monotonic()
+        with self._lock:
+            if self._file.closed:
+                return  # 終了処理後に届いたデータ
+            cid = self._channel_id(name)
+            self._file.write(RECORD_HEADER.pack(now, cid, len(data)))
+            self._file.write(data)
+            if now - self._last_flush >= self._flush_interval:
+                self._file.flush()
+                self._last_flush = now
+
+    def write_imu(self, gyro):
+        self.write(IMU_CHANNEL_NAME, IMU_SAMPLE.pack(gyro['x'], gyro['y'], gyro['z']))
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+def read_records(path):
+    # (タイムスタンプ, チャンネル名, ペイロード) を記録順に返すジェネレーター
+    # セッション開始レコードはチャンネル名 None で返す
+    names = {}
+    with open(path, 'rb') as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"記録ファイルではありません: {path}")
+        while True:
+            header = f.read(RECORD_HEADER.size)
+            if len(header) < RECORD_HEADER.size:
+                return
+            t, cid, length = RECORD_HEADER.unpack(header)
+            payload = f.read(length)
+            if len(payload) < length:
+                return  # 記録中に途切れた末尾レコード
+            if cid == DECLARE_CHANNEL:
+                names[payload[0]] = payload[1:].decode('utf-8')
+            elif cid == SESSION_CHANNEL:
+                names.clear()  # チャンネルIDはセッションごとに宣言し直される
+                yield t, None, payload
+            else:
+                yield t, names.get(cid, str(cid)), payload
+
+
+def declared_channels(path):
+    # 記録ファイルで宣言されているチャンネル名の集合（ペイロードは読み飛ばす）
+    names = set()
+    with open(path, 'rb') as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"記録ファイルではありません: {path}")
+        while True:
+            header = f.read(RECORD_HEADER.size)
+            if len(header) < RECORD_HEADER.size:
+                return names
+            _, cid, length = RECORD_HEADER.unpack(header)
+            if cid == DECLARE_CHANNEL:
+                names.add(f.read(length)[1:].decode('utf-8'))
+            else:
+                f.seek(length, 1)
+
+
+class ReplayImu:
+    # mpu6050 の代わりに読み取りスレッドへ渡す再生用IMU（次のサンプルまでブロックする）
+    def __init__(self):
+        self._queue = queue.Queue(maxsize=1)
+
+    def get_gyro_data(self):
+        # 't' には記録時のタイムスタンプが入る（倍速再生でも記録どおりのdtで積分できるように）
+        # 0.5秒以内にサンプルが届かなければ None（記録の途切れ・再生終了）
+        try:
+            t, payload = self._queue.get(timeout=0.5)
+        except queue.Empty:
+            return None
+        x, y, z = IMU_SAMPLE.unpack(payload)
+        return {'x': x, 'y': y, 'z': z, 't': t}
+
+
+class ReplaySource:
+    def __init__(self, path, speed=1.0, loop=False):
+        # speed: 再生速度の倍率。0以下なら待ち時間なしで最速再生
+        self.path = path
+        self.speed = speed
+        self.loop = loop
+        self._imu = None
+        self._sink = None
+        self.finished = threading.Event()
+        self.records = 0
+
+    def has_imu(self):
+        return IMU_CHANNEL_NAME in declared_channels(self.path)
+
+    def imu(self):
+        if self._imu is None:
+            self._imu = ReplayImu()
+        return self._imu
+
+    def start(self, sink):
+        # sink(name, payload): 再生スレッドから受信機ごとの受信データを直接渡す
+        self._sink = sink
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def _run(self):
+        while True:
+            start_rec = None
+            start_wall = time.monotonic()
+            for t, name, payload in read_records(self.path):
+                if name is None:
+                    # 次のセッション（別の起動）: タイムスタンプの基準が変わるので、間を空けずにそこから再生を続ける
+                    start_rec = None
+                    start_wall = time.monotonic()
+                    continue
+                if start_rec is None:
+                    start_rec = t
+                if self.speed > 0:
+                    delay = start_wall + (t - start_rec) / self.speed - time.monotonic()
+                    if delay > 0:
+                        time.sleep(delay)
+                if name == IMU_CHANNEL_NAME:
+                    if self._imu is not None:
+                        self._imu._queue.put((t, payload))
+                else:
+                    self._sink(name, payload)
+                self.records += 1
+            if not self.loop:
+                break
+        self.finished.set()
@@ -0,0 +1,314 @@
+# --- 記録したNMEAログの再処理 ---
+# 使い方: python3 reprocess.py base.nmea rover.nmea -o result.csv [--format csv|npz] [--jobs N] [--config config.ini]
+# 現場で記録した基準局・移動局の生NMEAログ（数GB）を、app1.py と同じヘディング・基線長誤差・HDOP判定
+# （heading_solver.HeadingSolver）で1エポックずつ計算し、列形式（CSV または NumPy の NPZ）で出力する。
+# - ファイルは固定サイズのチャンクで読み進め、結果も時間範囲ごとに書き出すので、ファイルサイズによらずメモリ使用量は一定
+# - エポックはGGAのUTC時刻で照合する（両ファイルの時刻は昇順であること）
+# - --jobs 2 以上では時間範囲に分割して複数プロセスで計算する。各範囲は開始時刻の少し前（ウィンドウ平滑化の助走分）
+#   から計算し、範囲内の行だけを出力するので、平滑化の結果も1プロセスで通して計算した場合と（浮動小数点の丸め誤差を除き）同じになる
+# - UTCは0時からの経過秒のため、日付をまたぐログにも対応する（ただしログの長さは23時間未満、両ファイルの開始時刻の差は1時間以内）
+import argparse
+import configparser
+import csv
+import math
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+import time
+import zipfile
+from collections import Counter, namedtuple
+
+import numpy as np
+
+from epoch_matcher import utc_key
+from heading_solver import REJECT_REASONS, HeadingSolver
+from nmea_parser import parse_gga
+from nmea_reader import NmeaFramer
+
+CHUNK_SIZE = 1024 * 1024        # 1回に読み取るバイト数
+PROBE_SIZE = 64 * 1024          # 時刻を調べるときに読み取るバイト数
+SEEK_RESOLUTION = 256 * 1024    # 時刻による二分探索を打ち切る幅（バイト）
+RANGE_BYTES = 64 * 1024 * 1024  # 1つの時間範囲の目安（基準局ファイルのバイト数、1範囲の結果をメモリに持つ上限）
+DAY = 86400.0
+REF_MARGIN = 3600.0             # 相対時刻の基準を最初のエポックより前に置く幅（両ファイルの開始時刻の差の上限）
+
+STATUS_OK = 0
+STATUS_CODES = {reason: i + 1 for i, reason in enumerate(REJECT_REASONS)}  # no_fix=1, hdop=2, residual=3
+
+# 出力する列: (名前, dtype)。除外したエポックの計算値は NaN
+COLUMNS = (
+    ('utc', 'f8'), ('status', 'i1'),
+    ('heading', 'f8'), ('smoothed', 'f8'), ('sigma', 'f8'), ('tilt', 'f8'), ('distance', 'f8'), ('error', 'f8'),
+    ('hdop_base', 'f8'), ('hdop_rover', 'f8'), ('num_sats_base', 'i2'), ('num_sats_rover', 'i2'),
+)
+
+Settings = namedtuple('Settings', 'baseline_length hdop_threshold window_size reject_error residual_scale wanted')
+
+
+def load_settings(path):
+    # app1.py と同じキー・既定値で読み取る
+    config = configparser.ConfigParser()
+    config.read(path)
+    return Settings(
+        config.getfloat('GPS', 'BaselineLengthMeter', fallback=0.7),
+        config.getfloat('GPS', 'HdopThreshold', fallback=2.0),
+        config.getint('Smoothing', 'WindowSize', fallback=10),
+        config.getfloat('Smoothing', 'RejectBaselineError', fallback=0.2),
+        config.getfloat('Smoothing', 'ResidualScale', fallback=0.05),
+        frozenset(
+            t.strip().encode('ascii') for t in config.get('GPS', 'Sentences', fallback='GPGGA,GNGGA').split(',')
+            if t.strip() and t.strip().endswith('GGA')
+        ),
+    )
+
+
+# --- NMEAファイルの読み取り ---
+def iter_fixes(path, wanted, ref, offset=0):
+    # offset バイト目以降のGGAを (ログ先頭基準の相対時刻, GgaFix) として順に返す
+    # 途中から読み始めた最初の不完全な文は NmeaFramer が捨てる
+    framer = NmeaFramer(wanted)
+    with open(path, 'rb') as f:
+        f.seek(offset)
+        while True:
+            chunk = f.read(CHUNK_SIZE)
+            if not chunk:
+                return
+            for sentence in framer.feed(chunk):
+                try:
+                    fix = parse_gga(sentence)
+                except ValueError:
+                    continue
+                if fix is not None and fix.utc is not None:
+                    yield (fix.utc - ref) % DAY, fix
+
+
+def first_time_after(path, offset, wanted, ref):
+    # offset バイト目以降で最初のGGAの相対時刻（PROBE_SIZE 以内に見つからなければ None）
+    framer = NmeaFramer(wanted)
+    with open(path, 'rb') as f:
+        f.seek(offset)
+        data = f.read(PROBE_SIZE)
+    for sentence in framer.feed(data):
+        try:
+            fix = parse_gga(sentence)
+        except ValueError:
+            continue
+        if fix is not None and fix.utc is not None:
+            return (fix.utc - ref) % DAY
+    return None
+
+
+def seek_time(path, t, wanted, ref):
+    # 相対時刻 t より前のGGAから読み始められるバイト位置を二分探索で求める
+    lo, hi = 0, os.path.getsize(path)
+    while hi - lo > SEEK_RESOLUTION:
+        mid = (lo + hi) // 2
+        found = first_time_after(path, mid, wanted, ref)
+        if found is None or found >= t:
+            hi = mid
+        else:
+            lo = mid
+    return lo
+
+
+def plan_ranges(base_path, wanted, ref, count):
+    # 基準局ファイルを count 等分した位置の時刻で区切った [開始, 終了) の一覧
+    size = os.path.getsize(base_path)
+    bounds = set()
+    for i in range(1, count):
+        t = first_time_after(base_path, size * i // count, wanted, ref)
+        if t is not None:
+            bounds.add(t)
+    edges = [-math.inf] + sorted(bounds) + [math.inf]
+    return list(zip(edges[:-1], edges[1:]))
+
+
+# --- 時間範囲ごとの計算 ---
+class ColumnBuffer:
+    def __init__(self):
+        self.columns = {name: [] for name, _ in COLUMNS}
+        self.counts = Counter()
+
+    def __len__(self):
+        return len(self.columns['utc'])
+
+    def add(self, base, rover, reason, result):
+        c = self.columns
+        c['utc'].append(base.utc)
+        c['status'].append(STATUS_OK if reason is None else STATUS_CODES[reason])
+        if result is None:
+            for name in ('heading', 'smoothed', 'sigma', 'tilt', 'distance', 'error'):
+                c[name].append(math.nan)
+        else:
+            c['heading'].append(result.heading)
+            c['smoothed'].append(result.smoothed)
+            c['sigma'].append(math.nan if result.sigma is None else result.sigma)
+            c['tilt'].append(result.tilt)
+            c['distance'].append(result.distance)
+            c['error'].append(result.error)
+        c['hdop_base'].append(base.hdop)
+        c['hdop_rover'].append(rover.hdop)
+        c['num_sats_base'].append(base.num_sats)
+        c['num_sats_rover'].append(rover.num_sats)
+        self.counts[reason or 'ok'] += 1
+
+    def arrays(self):
+        return {name: np.array(self.columns[name], dtype=dtype) for name, dtype in COLUMNS}
+
+
+def solve_range(base_path, rover_path, settings, ref, start, end, block_rows=65536):
+    # 相対時刻 [start, end) のエポックを計算し、(列の辞書, 件数) を block_rows 行ごとに返すジェネレーター
+    solver = HeadingSolver(settings.baseline_length, settings.hdop_threshold, settings.window_size,
+                           settings.reject_error, settings.residual_scale)
+    # ウィンドウ平滑化の状態を揃えるため、開始時刻の前から計算する（エポック間隔の上限2秒 × ウィンドウ長）
+    warm_start = start - settings.window_size * solver.window.max_gap
+    if math.isinf(start):
+        base_it = iter_fixes(base_path, settings.wanted, ref)
+        rover_it = iter_fixes(rover_path, settings.wanted, ref)
+    else:
+        base_it = iter_fixes(base_path, settings.wanted, ref, seek_time(base_path, warm_start, settings.wanted, ref))
+        rover_it = iter_fixes(rover_path, settings.wanted, ref, seek_time(rover_path, warm_start, settings.wanted, ref))
+    warm_key = -math.inf if math.isinf(warm_start) else utc_key(warm_start)
+    start_key = -math.inf if math.isinf(start) else utc_key(start)
+    end_key = math.inf if math.isinf(end) else utc_key(end)
+
+    buffer = ColumnBuffer()
+    b = next(base_it, None)
+    r = next(rover_it, None)
+    while b is not None and r is not None:
+        kb, kr = utc_key(b[0]), utc_key(r[0])
+        if min(kb, kr) >= end_key:
+            break
+        if kb < kr:
+            if kb >= start_key:
+                buffer.counts['unmatched_base'] += 1
+            b = next(base_it, None)
+        elif kr < kb:
+            if kr >= start_key:
+                buffer.counts['unmatched_rover'] += 1
+            r = next(rover_it, None)
+        else:
+            if kb >= warm_key:
+                reason, result = solver.solve(b[1].utc, b[1], r[1])
+                if kb >= start_key:
+                    buffer.add(b[1], r[1], reason, result)
+                    if len(buffer) >= block_rows:
+                        yield buffer.arrays(), buffer.counts
+                        buffer = ColumnBuffer()
+            b = next(base_it, None)
+            r = next(rover_it, None)
+    # 片方のファイルが終わった後の残りは照合できなかったエポック
+    for key, item, it in (('unmatched_base', b, base_it), ('unmatched_rover', r, rover_it)):
+        while item is not None and utc_key(item[0]) < end_key:
+            if utc_key(item[0]) >= start_key:
+                buffer.counts[key] += 1
+            item = next(it, None)
+    yield buffer.arrays(), buffer.counts
+
+
+def solve_range_all(args):
+    # multiprocessing 用: 1つの時間範囲の結果をまとめて返す
+    blocks = list(solve_range(*args))
+    columns = {name: np.concatenate([block[0][name] for block in blocks]) for name, _ in COLUMNS}
+    counts = Counter()
+    for _, block_counts in blocks:
+        counts.update(block_counts)
+    return columns, counts
+
+
+# --- 出力 ---
+class CsvWriter:
+    def __init__(self, path):
+        self._file = open(path, 'w', newline='')
+        self._writer = csv.writer(self._file)
+        self._writer.writerow([name for name, _ in COLUMNS])
+
+    def write(self, columns):
+        # NaN（除外したエポックの計算値）は空欄にする
+        rows = zip(*(columns[name].tolist() for name, _ in COLUMNS))
+        self._writer.writerows(['' if v != v else v for v in row] for row in rows)
+
+    def close(self):
+        self._file.close()
+
+
+class NpzWriter:
+    # 列ごとに一時ファイルへ追記し、最後に np.load で読める .npz（無圧縮zip）へまとめる
+    def __init__(self, path):
+        self.path = path
+        self._dir = tempfile.mkdtemp(prefix='reprocess-', dir=os.path.dirname(os.path.abspath(path)))
+        self._files = {name: open(os.path.join(self._dir, name), 'w+b') for name, _ in COLUMNS}
+        self._rows = 0
+
+    def write(self, columns):
+        for name, dtype in COLUMNS:
+            columns[name].astype(dtype, copy=False).tofile(self._files[name])
+        self._rows += len(columns['utc'])
+
+    def close(self):
+        try:
+            with zipfile.ZipFile(self.path, 'w', zipfile.ZIP_STORED, allowZip64=True) as zf:
+                for name, dtype in COLUMNS:
+                    f = self._files[name]
+                    f.seek(0)
+                    with zf.open(name + '.npy', 'w', force_zip64=True) as out:
+                        header = {'descr': np.lib.format.dtype_to_descr(np.dtype(dtype)),
+                                  'fortran_order': False, 'shape': (self._rows,)}
+                        np.lib.format.write_array_header_1_0(out, header)
+                        shutil.copyfileobj(f, out)
+        finally:
+            for f in self._files.values():
+                f.close()
+            shutil.rmtree(self._dir, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="記録した基準局・移動局のNMEAログからヘディングを再計算する")
+    parser.add_argument('base', help="基準局のNMEAログ")
+    parser.add_argument('rover', help="移動局のNMEAログ")
+    parser.add_argument('-o', '--output', required=True, help="出力ファイル")
+    parser.add_argument('--format', choices=('csv', 'npz'), help="出力形式（省略時は出力ファイルの拡張子から判断）")
+    parser.add_argument('--jobs', type=int, default=os.cpu_count() or 1, help="計算に使うプロセス数")
+    parser.add_argument('--config', default=os.environ.get('GPS_COMPASS_CONFIG', 'config.ini'),
+                        help="基線長・HDOP閾値・平滑化の設定を読み取る設定ファイル")
+    args = parser.parse_args()
+
+    settings = load_settings(args.config)
+    fmt = args.format or ('npz' if args.output.endswith('.npz') else 'csv')
+    first = first_time_after(args.base, 0, settings.wanted, 0.0)
+    if first is None:
+        sys.exit(f"{args.base} の先頭にGGAが見つかりません")
+    ref = first - REF_MARGIN
+
+    started = time.monotonic()
+    writer = NpzWriter(args.output) if fmt == 'npz' else CsvWriter(args.output)
+    counts = Counter()
+    try:
+        if args.jobs <= 1:
+            for columns, block_counts in solve_range(args.base, args.rover, settings, ref, -math.inf, math.inf):
+                writer.write(columns)
+                counts.update(block_counts)
+        else:
+            count = max(args.jobs * 4, os.path.getsize(args.base) // RANGE_BYTES)
+            tasks = [(args.base, args.rover, settings, ref, start, end)
+                     for start, end in plan_ranges(args.base, settings.wanted, ref, count)]
+            with multiprocessing.Pool(args.jobs) as pool:
+                # 時刻順に受け取り、順に書き出す
+                for columns, range_counts in pool.imap(solve_range_all, tasks):
+                    writer.write(columns)
+                    counts.update(range_counts)
+    finally:
+        writer.close()
+
+    elapsed = time.monotonic() - started
+    rows = counts['ok'] + sum(counts[reason] for reason in REJECT_REASONS)
+    print(f"エポック: {rows}（有効 {counts['ok']}, 測位なし {counts['no_fix']}, HDOP超過 {counts['hdop']}, "
+          f"基線長誤差超過 {counts['residual']}）", file=sys.stderr)
+    print(f"照合できなかったエポック: 基準局 {counts['unmatched_base']}, 移動局 {counts['unmatched_rover']}", file=sys.stderr)
+    print(f"処理時間: {elapsed:.1f}秒（{rows / elapsed if elapsed > 0 else 0:.0f} エポック/秒）→ {args.output}", file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
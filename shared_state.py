@@ -0,0 +1,89 @@
+import mmap
+import os
+import struct
+import threading
+import time
+
+# --- プロセス間共有の最新解（seqlock） ---
+# 取得プロセス（1つ）がシリアライズ済みのペイロードを共有メモリ上のファイルへ書き込み、
+# 任意の数のWebワーカーがロックなしで読み取る。
+# 書き込み中はシーケンス番号が奇数になり、読み取り側は前後で番号が一致するまで読み直す。
+# seqlockは書き込み側が1つであることが前提なので、取得プロセス内の複数スレッドからの書き込みはロックで直列化する。
+#
+# レイアウト: struct('<QQI')（シーケンス番号, バージョン, ペイロード長） + ペイロード領域
+
+HEADER = struct.Struct('<QQI')
+SEQ = struct.Struct('<Q')
+
+
+class SharedStateWriter:
+    def __init__(self, path, capacity=8192):
+        self.capacity = capacity
+        size = HEADER.size + capacity
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            if os.fstat(fd).st_size != size:
+                os.ftruncate(fd, size)
+            self._mm = mmap.mmap(fd, size)
+        finally:
+            os.close(fd)
+        # 再起動時もバージョンが巻き戻らないよう既存の値から続ける
+        seq, self.version, _ = HEADER.unpack_from(self._mm, 0)
+        self._seq = seq + (seq & 1)
+        self._lock = threading.Lock()
+
+    def write(self, payload: bytes, version=None):
+        # version: 書き込む解のバージョン（省略時は書き込みごとに1増やす）
+        length = len(payload)
+        if length > self.capacity:
+            raise ValueError(f"ペイロードが共有領域の容量を超えています: {length} > {self.capacity}")
+        mm = self._mm
+        with self._lock:
+            self._seq += 1
+            SEQ.pack_into(mm, 0, self._seq)  # 奇数: 書き込み中
+            mm[HEADER.size:HEADER.size + length] = payload
+            self.version = self.version + 1 if version is None else version
+            HEADER.pack_into(mm, 0, self._seq, self.version, length)
+            # シーケンス番号は最後に単独で書く（長さと同時に書くと、偶数になった番号と古い長さを読まれることがある）
+            self._seq += 1
+            SEQ.pack_into(mm, 0, self._seq)
+
+
+class SharedStateReader:
+    def __init__(self, path):
+        self.path = path
+        self._mm = None
+
+    def _open(self):
+        try:
+            fd = os.open(self.path, os.O_RDONLY)
+        except FileNotFoundError:
+            return False  # 取得プロセスがまだ起動していない
+        try:
+            if os.fstat(fd).st_size < HEADER.size:
+                return False  # 取得プロセスがファイルを作成した直後（サイズ確定前）。次の呼び出しで開き直す
+            self._mm = mmap.mmap(fd, 0, access=mmap.ACCESS_READ)
+        finally:
+            os.close(fd)
+        return True
+
+    def version(self):
+        if self._mm is None and not self._open():
+            return 0
+        return HEADER.unpack_from(self._mm, 0)[1]
+
+    def read(self):
+        # 戻り値: (バージョン, ペイロード)。未書き込みなら (0, None)
+        if self._mm is None and not self._open():
+            return 0, None
+        mm = self._mm
+        retries = 0
+        while True:
+            seq, version, length = HEADER.unpack_from(mm, 0)
+            if not seq & 1:
+                payload = mm[HEADER.size:HEADER.size + length]
+                if SEQ.unpack_from(mm, 0)[0] == seq:
+                    return version, (payload if version else None)
+            retries += 1
+            if retries % 100 == 0:
+                time.sleep(0)  # 書き込み側に実行を譲る
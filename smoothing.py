@@ -0,0 +1,81 @@
+import math
+from collections import deque
+
+# --- スライディングウィンドウによるヘディング平滑化 ---
+# 直近 size エポックのGPSヘディングを円周統計（単位ベクトルの重み付き和）で平均する。
+# 重みはHDOPと基線長誤差（実測距離と既知の基線長の差）から決め、誤差が上限を超えたエポックは除外する。
+# 和は追加・削除の差分で更新するので、1エポックあたりの計算量はウィンドウ長によらず O(1)。
+# 出力の σ は重み付き円周標準偏差を有効サンプル数で割った、平均ヘディングの標準誤差（度）。
+
+RESUM_INTERVAL = 10000  # 浮動小数点の誤差の蓄積を防ぐため、この回数ごとに和を計算し直す
+
+
+class HeadingWindow:
+    def __init__(self, size=10, max_residual=0.2, residual_scale=0.05, max_gap=2.0):
+        # size: 平均するエポック数
+        # max_residual: 基線長誤差（m）がこれを超えたエポックは外れ値として除外（0以下で無効）
+        # residual_scale: 重みを半分にする基線長誤差（m）
+        # max_gap: エポックの間隔（秒）がこれを超えたらウィンドウを空にする
+        self.size = size
+        self.max_residual = max_residual
+        self.residual_scale = residual_scale
+        self.max_gap = max_gap
+        self._samples = deque()  # (重み, 重み*sin, 重み*cos)
+        self._last_utc = None
+        self._updates = 0
+        self._w = self._w2 = self._s = self._c = 0.0
+        # 統計
+        self.accepted = 0
+        self.rejected = 0
+
+    def reset(self):
+        self._samples.clear()
+        self._w = self._w2 = self._s = self._c = 0.0
+
+    def weight(self, hdop, residual):
+        return 1.0 / (max(hdop, 0.1) ** 2 * (1.0 + (residual / self.residual_scale) ** 2))
+
+    def add(self, heading, hdop, residual, utc=None):
+        # heading: GPSヘディング（度）, hdop: 両端の大きい方のHDOP, residual: 基線長誤差（m）, utc: エポックのUTC秒
+        # 戻り値: 外れ値として除外した場合は False
+        if utc is not None:
+            if self._last_utc is not None and not 0.0 < utc - self._last_utc <= self.max_gap:
+                self.reset()  # 欠測・日付の切り替わり
+            self._last_utc = utc
+        if self.max_residual > 0 and abs(residual) > self.max_residual:
+            self.rejected += 1
+            return False
+        w = self.weight(hdop, residual)
+        rad = math.radians(heading)
+        sample = (w, w * math.sin(rad), w * math.cos(rad))
+        self._samples.append(sample)
+        self._w += w
+        self._w2 += w * w
+        self._s += sample[1]
+        self._c += sample[2]
+        if len(self._samples) > self.size:
+            old = self._samples.popleft()
+            self._w -= old[0]
+            self._w2 -= old[0] * old[0]
+            self._s -= old[1]
+            self._c -= old[2]
+        self._updates += 1
+        if self._updates % RESUM_INTERVAL == 0:
+            self._w = sum(x[0] for x in self._samples)
+            self._w2 = sum(x[0] * x[0] for x in self._samples)
+            self._s = sum(x[1] for x in self._samples)
+            self._c = sum(x[2] for x in self._samples)
+        self.accepted += 1
+        return True
+
+    def estimate(self):
+        # 戻り値: (平均ヘディング（度）, σ（度）)。ウィンドウが空なら (None, None)、1件だけなら σ は None
+        if not self._samples:
+            return None, None
+        heading = math.degrees(math.atan2(self._s, self._c)) % 360.0
+        if len(self._samples) < 2:
+            return heading, None
+        r = min(math.hypot(self._s, self._c) / self._w, 1.0)
+        spread = math.sqrt(-2.0 * math.log(r)) if r > 0 else math.pi
+        n_eff = self._w * self._w / self._w2
+        return heading, math.degrees(spread / math.sqrt(n_eff))
@@ -0,0 +1,103 @@
+import threading
+import time
+from collections import namedtuple
+
+from nmea_parser import GgaFix
+
+# --- センサー状態のスナップショット公開 ---
+# 書き込み側は変更を反映した新しい不変スナップショットを作り、参照を差し替えて公開する。
+# 読み取り側は current を参照するだけでロックを取らず、
+# 基準局の緯度と前回の経度が混ざるような中途半端な状態を見ることもない。
+
+NO_FIX = GgaFix(None, 0.0, 0.0, 0, 0, 99.9, 0.0)
+
+# 基線ごとの解。tilt は基線方向の傾き（度、移動側が高いと正）、smoothed / sigma はウィンドウ平滑化後のヘディングとσ（度）
+BaselineSolution = namedtuple('BaselineSolution', 'utc heading smoothed sigma tilt distance error skew latency')
+
+
+class Snapshot:
+    __slots__ = (
+        'version',
+        'fixes',                    # 受信機名 -> GgaFix
+        'baselines',                # 基線名 -> BaselineSolution
+        'heading_gps',              # 主基線（最初の基線）のGPSヘディング。distance・error・epoch_* も主基線の値
+        'heading_fused',            # 融合ヘディング（IMUなしの場合は平滑化したGPSヘディング）
+        'heading_sigma',            # heading_fused の標準偏差（度）。推定できない間は None
+        'distance',                 # ベースとローバー間の距離（メートル）
+        'error',                    # 基線誤差（メートル）
+        'imu_status', 'imu_raw_gyro_z',
+        'epoch_utc',                # 解のエポック（UTC 0時からの秒）
+        'epoch_skew',               # 基準局・移動局の同一エポック到着時刻差（秒）
+        'heading_latency',          # エポック揃いからヘディング算出までの遅延（秒）
+    )
+
+    def __init__(self, version=0, fixes=None, baselines=None, heading_gps=0.0, heading_fused=0.0, heading_sigma=None,
+                 distance=0.0, error=0.0, imu_status=False, imu_raw_gyro_z=0.0,
+                 epoch_utc=None, epoch_skew=0.0, heading_latency=0.0):
+        set_field = object.__setattr__
+        set_field(self, 'version', version)
+        set_field(self, 'fixes', fixes if fixes is not None else {})
+        set_field(self, 'baselines', baselines if baselines is not None else {})
+        set_field(self, 'heading_gps', heading_gps)
+        set_field(self, 'heading_fused', heading_fused)
+        set_field(self, 'heading_sigma', heading_sigma)
+        set_field(self, 'distance', distance)
+        set_field(self, 'error', error)
+        set_field(self, 'imu_status', imu_status)
+        set_field(self, 'imu_raw_gyro_z', imu_raw_gyro_z)
+        set_field(self, 'epoch_utc', epoch_utc)
+        set_field(self, 'epoch_skew', epoch_skew)
+        set_field(self, 'heading_latency', heading_latency)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("Snapshot は変更できません。SnapshotStore.update を使用してください")
+
+    def fix(self, name):
+        return self.fixes.get(name, NO_FIX)
+
+    def evolve(self, version, changes):
+        fields = {name: getattr(self, name) for name in self.__slots__}
+        fields.update(changes)
+        fields['version'] = version
+        return Snapshot(**fields)
+
+
+class SnapshotStore:
+    def __init__(self, wait_histogram=None):
+        # wait_histogram: 書き込みロックの待ち時間を記録するヒストグラム（metrics.Histogram）
+        self._cond = threading.Condition()
+        self._wait_histogram = wait_histogram
+        self.current = Snapshot()
+
+    def update(self, **changes):
+        # 書き込み同士だけを直列化し、新しいスナップショットを参照の差し替えで公開する
+        return self._publish(None, None, None, changes)
+
+    def update_item(self, field, key, value, **changes):
+        # 辞書フィールド（fixes / baselines）の1要素を差し替える。
+        # 複製はロック内で行うので、複数のスレッドが別の要素を同時に更新しても失われない
+        return self._publish(field, key, value, changes)
+
+    def _publish(self, field, key, value, changes):
+        t0 = time.perf_counter()
+        with self._cond:
+            if self._wait_histogram is not None:
+                self._wait_histogram.observe(time.perf_counter() - t0)
+            if field is not None:
+                mapping = dict(getattr(self.current, field))
+                mapping[key] = value
+                changes[field] = mapping
+            snapshot = self.current.evolve(self.current.version + 1, changes)
+            self.current = snapshot
+            self._cond.notify_all()
+        return snapshot
+
+    def wait_for(self, version, timeout=None):
+        # version より新しいスナップショットが公開されるまで待つ。タイムアウト時は None
+        snapshot = self.current
+        if snapshot.version > version:
+            return snapshot
+        with self._cond:
+            if self._cond.wait_for(lambda: self.current.version > version, timeout):
+                return self.current
+        return None